@@ -49,6 +49,12 @@ setup(name='xmiparser',
           'zodict',
       ],
       extras_require = dict(
+          lxml=[
+            'lxml',
+          ],
+          xz=[
+            'backports.lzma',
+          ],
           test=[
             'interlude',
             'zope.component',
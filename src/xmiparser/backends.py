@@ -0,0 +1,192 @@
+# Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
+# GNU General Public License Version 2 or later
+
+import logging
+from xml.dom import minidom
+from xml.dom import xmlbuilder
+from xml.dom.expatbuilder import ExpatBuilderNS
+from xml.dom.expatbuilder import Rejecter
+from zope.interface import implements
+from interfaces import IParserBackend
+import streamdom
+try:
+    import lxmldom
+except ImportError:
+    lxmldom = None
+
+log = logging.getLogger('XMIparser')
+
+# subtrees xmiparser never reads: vendor extensions and diagram geometry
+IGNORE = frozenset([
+    'XMI.extension',
+    'UML:Diagram.element',
+    'UML:Diagram.viewport',
+    'UML:GraphElement.position',
+    'UML:GraphNode.size',
+    'UML:GraphEdge.waypoints',
+])
+
+class ParseFilter(object):
+    """What backends drop from a document while parsing it.
+
+    Ignorable whitespace is whitespace between elements, the text of elements
+    without child elements is kept.
+    """
+
+    def __init__(self, whitespace=True, comments=True, ignore=IGNORE):
+        """
+        @param whitespace: drop ignorable whitespace
+        @param comments: drop comments
+        @param ignore: tag names of subtrees to drop
+        """
+        self.whitespace = whitespace
+        self.comments = comments
+        self.ignore = frozenset(ignore)
+
+    def __repr__(self):
+        return '<ParseFilter whitespace=%s comments=%s ignore=%s>' % \
+            (self.whitespace, self.comments, ', '.join(sorted(self.ignore)))
+
+def getFilter(filter):
+    """Return the ``ParseFilter`` for filter, True for the default one, or
+    None.
+    """
+    if filter is True:
+        return ParseFilter()
+    return filter or None
+
+def _removeLastChild(parent):
+    # minidom's removeChild searches the children from the start
+    children = parent.childNodes
+    node = children.pop()
+    if children:
+        children[-1].__dict__['nextSibling'] = None
+    d = node.__dict__
+    d['parentNode'] = d['previousSibling'] = None
+    return node
+
+class FilteringBuilder(ExpatBuilderNS):
+    """Builds a minidom document, dropping what a ``ParseFilter`` asks for
+    before it is stored.
+    """
+
+    def __init__(self, filter):
+        options = xmlbuilder.Options()
+        options.comments = not filter.comments
+        ExpatBuilderNS.__init__(self, options)
+        self.whitespace = filter.whitespace
+        self.ignore = filter.ignore
+        # ids of open elements which had ignored children
+        self.ignoredIn = set()
+
+    def _dropWhitespace(self):
+        children = self.curNode.childNodes
+        if children and children[-1].nodeType == minidom.Node.TEXT_NODE \
+           and not children[-1].data.strip():
+            _removeLastChild(self.curNode)
+
+    def start_element_handler(self, name, attributes):
+        if self.whitespace:
+            # indentation before an element
+            self._dropWhitespace()
+        ExpatBuilderNS.start_element_handler(self, name, attributes)
+        node = self.curNode
+        if node.tagName in self.ignore \
+           and node is not self.document.documentElement:
+            self.curNode = node.parentNode
+            _removeLastChild(self.curNode)
+            self.ignoredIn.add(id(self.curNode))
+            node.unlink()
+            # swallows the events up to the end of node
+            Rejecter(self)
+
+    def end_element_handler(self, name):
+        if self.whitespace:
+            node = self.curNode
+            children = node.childNodes
+            # indentation after the last child element
+            if len(children) > 1 \
+               and children[-2].nodeType == minidom.Node.ELEMENT_NODE \
+               or id(node) in self.ignoredIn:
+                self._dropWhitespace()
+        self.ignoredIn.discard(id(self.curNode))
+        ExpatBuilderNS.end_element_handler(self, name)
+
+class MinidomBackend(object):
+    """Build the complete DOM tree with ``xml.dom.minidom``.
+    """
+    implements(IParserBackend)
+
+    def __init__(self, filter=None):
+        self.filter = getFilter(filter)
+
+    def parse(self, source):
+        if self.filter is None:
+            return minidom.parse(source)
+        builder = FilteringBuilder(self.filter)
+        if isinstance(source, basestring):
+            source = open(source, 'rb')
+            try:
+                return builder.parseFile(source)
+            finally:
+                source.close()
+        return builder.parseFile(source)
+
+class StreamingBackend(object):
+    """Build a compact document straight from the expat events.
+
+    The nodes provide the part of the ``xml.dom`` API xmiparser uses, without
+    the per node overhead of minidom. Ignorable whitespace and the subtrees
+    ignored by the filter are dropped before any node is created for them.
+    Without a filter ``XMI.extension`` blocks are ignored and comments
+    dropped.
+    """
+    implements(IParserBackend)
+
+    def __init__(self, filter=None):
+        self.filter = getFilter(filter) or ParseFilter(
+            ignore=['XMI.extension'])
+
+    def parse(self, source):
+        log.debug("Streaming parse, ignoring %r.", self.filter.ignore)
+        return streamdom.parse(source, self.filter)
+
+class LxmlBackend(object):
+    """Parse with lxml.
+
+    The elements of the returned document provide the DOM accessors xmiparser
+    uses and answer tag name lookups with precompiled XPath expressions.
+    """
+    implements(IParserBackend)
+
+    def __init__(self, filter=None):
+        self.filter = getFilter(filter)
+
+    def parse(self, source):
+        return lxmldom.parse(source, self.filter)
+
+BACKENDS = {
+    'minidom': MinidomBackend,
+    'streaming': StreamingBackend,
+    'lxml': LxmlBackend,
+}
+
+def getBackend(backend, filter=None):
+    """Return an ``IParserBackend`` for a registered name or pass through an
+    already instanciated backend.
+
+    Asking for ``lxml`` without lxml being installed returns the minidom
+    backend. filter, a ``ParseFilter`` or True for the default one, is passed
+    to backends created by name.
+    """
+    if IParserBackend.providedBy(backend):
+        return backend
+    if backend == 'lxml' and lxmldom is None:
+        log.warn("lxml is not installed, falling back to minidom.")
+        backend = 'minidom'
+    try:
+        factory = BACKENDS[backend]
+    except KeyError:
+        raise ValueError, "Unknown parser backend '%s', use one of: %s" % \
+            (backend, ', '.join(sorted(BACKENDS.keys())))
+    return factory(filter=filter)
@@ -0,0 +1,107 @@
+# Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
+# GNU General Public License Version 2 or later
+
+import os
+import time
+import logging
+import traceback
+import multiprocessing
+from factory import ModelFactory
+
+log = logging.getLogger('XMIparser')
+
+class ParseResult(object):
+    """Outcome of parsing one file of a batch.
+
+    Only holds plain data, so it can be sent between processes.
+    """
+
+    def __init__(self, path, summary=None, error=None, traceback=None,
+                 duration=0.0):
+        self.path = path
+        self.summary = summary
+        self.error = error
+        self.traceback = traceback
+        self.duration = duration
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<ParseResult %s %s %.2fs>' % (os.path.basename(self.path),
+                                              self.ok and 'ok' or 'failed',
+                                              self.duration)
+
+def summarizeModel(model):
+    """Return a picklable summary of model.
+
+    Models reference their DOM and can't be sent between processes, this is
+    what is sent instead.
+    """
+    XMI = model.XMI
+    counts = {}
+    for name in ('PACKAGE', 'CLASS', 'INTERFACE', 'ASSOCIATION',
+                 'GENERALIZATION', 'DEPENDENCY', 'STATEMACHINE'):
+        # references to elements use the same tag, count definitions only
+        els = XMI.index.getElementsByTagName(getattr(XMI, name))
+        counts[name.lower()] = len([e for e in els if XMI.getId(e)])
+    return {
+        'name': XMI.getName(model.model),
+        'flavor': XMI.__class__.__name__,
+        'counts': counts,
+        'packages': [p.qualifiedName
+                     for p in model.getPackages(recursive=1)],
+        'classes': [c.qualifiedName
+                    for c in model.getClasses(recursive=1)],
+    }
+
+_factories = {}
+
+def parseOne(path, backend='minidom', summarize=summarizeModel):
+    """Parse a single file and return its ``ParseResult``.
+
+    Never raises, errors are reported on the result.
+    """
+    start = time.time()
+    try:
+        factory = _factories.get(backend)
+        if factory is None:
+            factory = _factories[backend] = ModelFactory(backend=backend)
+        summary = summarize(factory(path))
+    except Exception, e:
+        log.warn("Parsing '%s' failed: %s", path, e)
+        return ParseResult(path,
+                           error='%s: %s' % (e.__class__.__name__, e),
+                           traceback=traceback.format_exc(),
+                           duration=time.time() - start)
+    return ParseResult(path, summary=summary, duration=time.time() - start)
+
+def _parseOne(args):
+    return parseOne(*args)
+
+def parseMany(paths, workers=None, backend='minidom',
+              summarize=summarizeModel):
+    """Parse many files in a pool of worker processes.
+
+    Returns a ``ParseResult`` per path, in the order of paths. A file failing
+    to parse doesn't abort the batch, its result carries the error.
+
+    @param workers: number of processes, defaults to the number of CPUs.
+                    With 1 the files are parsed in this process.
+    @param summarize: picklable callable turning a model into what is
+                      returned on ``ParseResult.summary``
+    """
+    tasks = [(path, backend, summarize) for path in paths]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(tasks))
+    if workers <= 1:
+        return [_parseOne(task) for task in tasks]
+    log.info("Parsing %d files in %d processes.", len(tasks), workers)
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(_parseOne, tasks, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
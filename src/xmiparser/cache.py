@@ -0,0 +1,208 @@
+# Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
+# GNU General Public License Version 2 or later
+
+import os
+import time
+import logging
+import tempfile
+import cPickle
+from xml.dom import Node
+try:
+    from hashlib import sha1
+except ImportError: # BBB python < 2.5
+    from sha import new as sha1
+
+log = logging.getLogger('XMIparser')
+
+# bump when the snapshot layout changes. Changes of the code building the
+# models are covered by codeDigest, unreleased ones included.
+FORMAT = '1'
+
+try:
+    VERSION = __import__('pkg_resources').get_distribution('xmiparser').version
+except Exception:
+    VERSION = 'dev'
+
+_codeDigest = None
+
+def codeDigest():
+    """Return a digest of the xmiparser modules, computed once.
+    """
+    global _codeDigest
+    if _codeDigest is None:
+        digest = sha1()
+        root = os.path.dirname(os.path.abspath(__file__))
+        for dirpath, dirnames, filenames in os.walk(root):
+            if 'tests' in dirnames:
+                dirnames.remove('tests')
+            dirnames.sort()
+            for name in sorted(filenames):
+                if not name.endswith('.py'):
+                    continue
+                path = os.path.join(dirpath, name)
+                digest.update('\0%s\0' % path[len(root):])
+                f = open(path, 'rb')
+                try:
+                    digest.update(f.read())
+                finally:
+                    f.close()
+        _codeDigest = digest.hexdigest()
+    return _codeDigest
+
+_domTypes = [Node]
+try:
+    from lxml import etree
+    import lxmldom
+    _domTypes.extend([etree._Element, lxmldom.Text, lxmldom.Document])
+except ImportError:
+    pass
+_domTypes = tuple(_domTypes)
+
+class SnapshotError(TypeError):
+    """A model still references its DOM and can't be snapshot.
+    """
+
+def _checkNoDOM(obj):
+    if isinstance(obj, _domTypes):
+        raise SnapshotError, 'snapshot references DOM node %r' % obj
+    return None
+
+class ParseCache(object):
+    """Persistent cache of parsed models in a directory.
+
+    Snapshots are keyed by a hash of the parsed files, the configuration of
+    the factory, the xmiparser version and its sources. A changed input,
+    configuration, release or module never hits a stale entry. Snapshots
+    hold the model without its DOM.
+    """
+
+    suffix = '.snapshot'
+
+    def __init__(self, directory, maxSize=None, maxAge=None):
+        """
+        @param maxSize: maximum total size of the snapshots in bytes
+        @param maxAge: maximum age of unused snapshots in seconds
+        """
+        self.directory = directory
+        self.maxSize = maxSize
+        self.maxAge = maxAge
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, paths, configuration=()):
+        """Return the cache key for the files in paths, parsed with the
+        configuration, a sequence of strings.
+        """
+        digest = sha1()
+        digest.update('%s:%s:%s' % (FORMAT, VERSION, codeDigest()))
+        for value in configuration:
+            digest.update('\0%s' % value)
+        digest.update('\0\0')
+        for path in paths:
+            digest.update('\0')
+            f = open(path, 'rb')
+            try:
+                while True:
+                    chunk = f.read(65536)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+            finally:
+                f.close()
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def load(self, key):
+        """Return the model stored under key or None.
+        """
+        path = self.path(key)
+        try:
+            f = open(path, 'rb')
+        except IOError:
+            return None
+        try:
+            try:
+                model = cPickle.load(f)
+            except Exception, e:
+                log.warn("Dropping broken snapshot '%s': %s", path, e)
+                self._remove(path)
+                return None
+        finally:
+            f.close()
+        # mark as used, eviction drops the least recently used first
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        log.info("Loaded model from snapshot '%s'.", path)
+        return model
+
+    def store(self, key, model):
+        """Store a snapshot of model under key.
+
+        Returns False if the model can't be snapshot.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        f = os.fdopen(fd, 'wb')
+        try:
+            try:
+                pickler = cPickle.Pickler(f, cPickle.HIGHEST_PROTOCOL)
+                pickler.persistent_id = _checkNoDOM
+                pickler.dump(model)
+            finally:
+                f.close()
+        except Exception, e:
+            log.warn("Can't snapshot model: %s", e)
+            self._remove(tmp)
+            return False
+        # readers never see partially written snapshots
+        os.rename(tmp, self.path(key))
+        self.evict()
+        return True
+
+    def entries(self):
+        """Return (mtime, size, path) of all snapshots, oldest first.
+        """
+        res = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            res.append((st.st_mtime, st.st_size, path))
+        res.sort()
+        return res
+
+    def evict(self):
+        """Remove snapshots older than maxAge, then the least recently used
+        ones until the total size is below maxSize.
+        """
+        if self.maxSize is None and self.maxAge is None:
+            return
+        entries = self.entries()
+        if self.maxAge is not None:
+            limit = time.time() - self.maxAge
+            for entry in [e for e in entries if e[0] < limit]:
+                self._remove(entry[2])
+                entries.remove(entry)
+        if self.maxSize is not None:
+            total = sum([e[1] for e in entries])
+            while entries and total > self.maxSize:
+                mtime, size, path = entries.pop(0)
+                self._remove(path)
+                total -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -3,12 +3,20 @@
 
 import os
 import logging
-from zipfile import ZipFile
-from xml.dom import minidom
 from zope.interface import implements
 from interfaces import IModelFactory
+from backends import getBackend
+from backends import getFilter
+from cache import ParseCache
+from sources import Source
+from sources import isData
+from sources import findDocument
+from sources import sniffHeader
+from sources import PeekableFile
+from sources import HEADER_SIZE
 import zargoparser
 import xmiutils
+from xmiutils import TagIndex
 import xmielements
 import flavors
 
@@ -16,83 +24,180 @@ log = logging.getLogger('XMIparser')
 
 class ModelFactory(object):
     
+    """Create models from XMI sources.
+
+    A factory keeps no state between calls. One factory can be called from
+    several threads at the same time, each call builds an independent model.
+    """
     implements(IModelFactory)
-      
+    
+    def __init__(self, backend='minidom', cache=None, detach=None,
+                 filter=None, lazy=False):
+        """
+        @param cache: directory or ``ParseCache`` to keep snapshots of parsed
+                      models in. Snapshots have no DOM, models of a factory
+                      with a cache are always detached.
+        @param detach: drop the DOM once a model is built, the default with
+                       a cache. False can't be combined with a cache.
+        @param filter: ``ParseFilter`` telling the backend what to drop while
+                       parsing, True for the default one
+        @param lazy: build packages when they are first accessed
+        """
+        self.filter = getFilter(filter)
+        self.backend = getBackend(backend, self.filter)
+        if isinstance(cache, basestring):
+            cache = ParseCache(cache)
+        if cache is not None:
+            if detach is not None and not detach:
+                raise ValueError, "Cached models have no DOM, detach=False " \
+                                  "can't be combined with a cache"
+            detach = True
+        self.cache = cache
+        self.detach = bool(detach)
+        self.lazy = lazy
+
     def __call__(self, sourcepath):
-        log.info("Parsing...")
-        self.XMI = None
-        profile_docs = {}
-        suff = os.path.splitext(sourcepath)[1].lower()
-        if suff in ('.xmi', '.xml', '.uml'):
-            log.debug("Opening %s ..." % suff)
-            doc = minidom.parse(sourcepath)
-        elif suff in ('.zargo', '.zuml', '.zip'):
-            if suff == '.zargo':
-                profiles_directories = zargoparser.getProfilesDirectories()
-                if profiles_directories:
-                    log.info("Directories to search for profiles: %s",
-                             str(profiles_directories))
-            log.debug("Opening %s ..." % suff)
-            zf = ZipFile(sourcepath)
-            xmis = [n for n in zf.namelist() \
-                    if os.path.splitext(n)[1].lower() in ('.xmi','.xml')]
-            assert(len(xmis)==1)
+        if self.cache is None or not isinstance(sourcepath, basestring) \
+           or isData(sourcepath):
+            # only files can be cached, their content is hashed twice
+            return self._build(sourcepath)
+        key = self.cache.key(self._sourceFiles(sourcepath),
+                             self.configuration())
+        model = self.cache.load(key)
+        if model is None:
+            model = self._build(sourcepath)
+            self.cache.store(key, model)
+        return model
 
-            # search for profiles includes in *.zargo zipfile
-            profile_files = {}
-            profiles = [n for n in zf.namelist() \
-                            if os.path.splitext(n)[1].lower() in ('.profile',)]
-            if profiles:
-                assert(len(profiles)==1)
-                for fn in zargoparser.getProfileFilenames(zf.read(profiles[0])):
-                    found = False
-                    for profile_directory in profiles_directories:
-                        profile_path = os.path.join(profile_directory, fn)
-                        if os.path.exists(profile_path):
-                            profile_files[fn] = profile_path
-                            found = True
-                            break
-                    if not found:
-                        raise IOError("Profile %s not found" % fn)
-                log.info("Profile files: '%s'" % str(profile_files))
-                for f, content in profile_files.items():
-                    profile_docs[f] = minidom.parse(content)
+    def configuration(self):
+        """Return what makes models of this factory differ from the models
+        other factories build from the same files.
+        """
+        backend = self.backend.__class__
+        return ('%s.%s' % (backend.__module__, backend.__name__),
+                repr(self.filter), 'lazy=%s' % bool(self.lazy))
 
-            buf = zf.read(xmis[0])
-            doc = minidom.parseString(buf)
-        else:
-            raise ValueError("Input file not of the following types: "
-                            ".xmi, .xml, .uml, .zargo, .zuml, .zip")
-    
-        xmi = doc.getElementsByTagName('XMI')[0]
+    def _build(self, sourcepath):
+        source = Source(sourcepath)
         try:
-            xmiver = str(xmi.getAttribute('xmi.version'))
-        except:
-            xmiver = '1.0'
-            log.warn("No version info found, taking XMI1_0.")
-        log.debug("Detected XMI version: %s", xmiver)
-        if xmiver >= "1.2":
-            log.debug("Using xmi 1.2 flavor.")
-            self.XMI = flavors.xmi1_2.XMI1_2()
-        elif xmiver >= "1.1":
-            log.debug("Using xmi 1.1 flavor.")
-            self.XMI = flavors.xmi1_1.XMI1_1()
+            model = self._parse(source)
+        finally:
+            source.close()
+        if self.detach:
+            model.detach()
+            log.debug("Detached model from DOM.")
+        return model
+
+    def _sourceFiles(self, sourcepath):
+        """Return the paths of all files the model of sourcepath is read from.
+        """
+        source = Source(sourcepath)
+        try:
+            if not source.isArchive:
+                return [sourcepath]
+            zf = source.archive()
+            try:
+                profile_files = self._profileFiles(zf)
+            finally:
+                zf.close()
+        finally:
+            source.close()
+        return [sourcepath] + [profile_files[fn]
+                               for fn in sorted(profile_files.keys())]
+
+    def _profileFiles(self, zf):
+        """Search for the profiles included by a zipfile.
+        """
+        profile_files = {}
+        profiles = [n for n in zf.namelist() \
+                        if os.path.splitext(n)[1].lower() in ('.profile',)]
+        if not profiles:
+            return profile_files
+        assert(len(profiles)==1)
+        profiles_directories = []
+        if [n for n in zf.namelist() if n.lower().endswith('.argo')]:
+            # ArgoUML project
+            profiles_directories = zargoparser.getProfilesDirectories()
+            if profiles_directories:
+                log.info("Directories to search for profiles: %s",
+                         str(profiles_directories))
+        for fn in zargoparser.getProfileFilenames(zf.read(profiles[0])):
+            found = False
+            for profile_directory in profiles_directories:
+                profile_path = os.path.join(profile_directory, fn)
+                if os.path.exists(profile_path):
+                    profile_files[fn] = profile_path
+                    found = True
+                    break
+            if not found:
+                raise IOError("Profile %s not found" % fn)
+        return profile_files
+
+    def _parse(self, source):
+        log.info("Parsing %s...", source.name)
+        profile_docs = {}
+        if not source.isArchive:
+            header = source.header()
+            doc = self.backend.parse(source.stream)
         else:
-            log.debug("Using xmi 1.0 flavor.")
-            self.XMI = flavors.xmi1_0.XMI1_0()
+            log.debug("Opening archive ...")
+            zf = source.archive()
+            try:
+                name = findDocument(zf)
 
-#        if profile_docs: 
-#            for profile_key, profile_doc in profile_docs.items():
-#                datatype = self._buildDataTypes(profile_doc, profile=profile_key)
-#                self._buildStereoTypes(profile_doc,profile=profile_key)
-#        datatypes = self._buildDataTypes(doc) #XXX unused
-#        stereotypes = self._buildStereoTypes(doc) #XXX unused
-        root = xmielements.XMIModel('model', doc, self.XMI)
-        root.__xmi__ = self.XMI
+                # search for profiles includes in *.zargo zipfile
+                profile_files = self._profileFiles(zf)
+                if profile_files:
+                    log.info("Profile files: '%s'" % str(profile_files))
+                    for f, path in profile_files.items():
+                        profile_docs[f] = self._parseFile(path)
+
+                # parse from the decompressing stream, the member is never
+                # held in memory as a whole
+                member = zf.open(name)
+                try:
+                    stream = PeekableFile(member)
+                    header = sniffHeader(stream.peek(HEADER_SIZE))
+                    doc = self.backend.parse(stream)
+                finally:
+                    member.close()
+            finally:
+                zf.close()
+    
+        index = TagIndex(doc)
+        xmiver = header.version
+        if xmiver is None:
+            # not in the first bytes, look it up in the document
+            try:
+                xmi = index.getElementsByTagName('XMI')[0]
+                xmiver = str(xmi.getAttribute('xmi.version'))
+            except:
+                xmiver = '1.0'
+                log.warn("No version info found, taking XMI1_0.")
+        log.debug("Detected XMI version: %s, exporter: %s", xmiver,
+                  header.exporter)
+        flavor = flavors.getFlavor(xmiver)
+        log.debug("Using %s flavor.", flavor.__name__)
+        XMI = flavor(index=index, header=header)
+
+        for profile_key, profile_doc in profile_docs.items():
+            XMI.datatypes.update(self._buildDataTypes(XMI, profile_doc,
+                                                      profile=profile_key))
+        XMI.datatypes.update(self._buildDataTypes(XMI, doc))
+        root = xmielements.XMIModel('model', doc, XMI, lazy=self.lazy)
+        root.__xmi__ = XMI
+        root.initialize(None)
         log.debug("Created XMI Model.")
         return root
         
-    def _buildDataTypes(self, doc, profile=''):
+    def _parseFile(self, path):
+        f = open(path, 'rb')
+        try:
+            return self.backend.parse(f)
+        finally:
+            f.close()
+
+    def _buildDataTypes(self, XMI, doc, profile=''):
         datatypes = {}
         if profile:
             log.debug("DataType profile: %s", profile)
@@ -100,27 +205,19 @@ class ModelFactory(object):
         else:
             getId = lambda e: str(e.getAttribute('xmi.id'))
     
-        dts = doc.getElementsByTagName(self.XMI.DATATYPE)
+        index = XMI.getIndex(doc)
+        dts = index.getElementsByTagName([XMI.DATATYPE,
+                                          XMI.CLASS,
+                                          XMI.INTERFACE,
+                                          XMI.ACTOR])
         for dt in dts:
             datatypes[getId(dt)] = dt
-
-        classes = [c for c in doc.getElementsByTagName(self.XMI.CLASS)]    
-        for dt in classes:
-            datatypes[getId(dt)] = dt
-    
-        interfaces = [c for c in doc.getElementsByTagName(self.XMI.INTERFACE)]
-        for dt in interfaces:
-            datatypes[getId(dt)] = dt
-    
-        interfaces = [c for c in doc.getElementsByTagName(self.XMI.ACTOR)]
-        for dt in interfaces:
-            datatypes[getId(dt)] = dt
     
         prefix = profile + "#" if profile else ''
-        self.XMI.collectTagDefinitions(doc, prefix=prefix)
+        XMI.collectTagDefinitions(doc, prefix=prefix)
         return datatypes
     
-    def _buildStereoTypes(self, doc, profile=''):
+    def _buildStereoTypes(self, XMI, doc, profile=''):
         stereotypes = {}
         if profile:
             log.debug("Stereotype profile: %s", profile)
@@ -128,7 +225,7 @@ class ModelFactory(object):
         else:
             getId = lambda e: str(e.getAttribute('xmi.id'))
         
-        sts = doc.getElementsByTagName(self.XMI.STEREOTYPE)
+        sts = XMI.getIndex(doc).getElementsByTagName(XMI.STEREOTYPE)
     
         for st in sts:
             id = st.getAttribute('xmi.id')
@@ -1,3 +1,12 @@
 import xmi1_0
 import xmi1_1
 import xmi1_2
+
+def getFlavor(version):
+    """Return the flavor class for the XMI version string.
+    """
+    if version >= "1.2":
+        return xmi1_2.XMI1_2
+    if version >= "1.1":
+        return xmi1_1.XMI1_1
+    return xmi1_0.XMI1_0
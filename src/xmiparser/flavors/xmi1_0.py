@@ -1,11 +1,21 @@
 # Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
 # GNU General Public License Version 2 or later
 
+import logging
 from zope.interface import implements
 from xmiparser.interfaces import IXMIFlavor
 from xmiparser.utils import normalize
+from xmiparser.xmiutils import getSubElement
+from xmiparser.xmiutils import getAttributeValue
 from xmiparser.xmiutils import getElementByTagName
 from xmiparser.xmiutils import getElementsByTagName
+from xmiparser.xmiutils import TagIndex
+from xmiparser.xmielements import XMIAssociation
+from xmiparser.xmielements import XMIAssociationClass
+from xmiparser.xmielements import XMIAbstraction
+from xmiparser.xmielements import XMIDependency
+
+log = logging.getLogger('XMIparser')
 
 class XMI1_0(object):
     
@@ -118,11 +128,54 @@ class XMI1_0(object):
     # XXX: generator specific, move out of here 
     generate_datatypes=['field','compound_field']
 
+    # TagIndex of the parsed document
+    index = None
+
     def __init__(self, **kw):
+        # all state gathered while building belongs to the flavor instance,
+        # the factory creates one per model.
+        # stereotype indexes by the TagIndex of their document
+        self.stereotypeIndexes = {}
+        self.datatypes = {}
+        self.datatypenames = []
         self.__dict__.update(kw)
+        if self.index is not None:
+            self.index.document.xmiTagIndex = self.index
+
+    def getIndex(self, doc):
+        """Return the ``TagIndex`` of doc, built on first use.
+
+        The index is kept on the document, it goes away together with it.
+        """
+        try:
+            return doc.xmiTagIndex
+        except AttributeError:
+            index = doc.xmiTagIndex = TagIndex(doc)
+            return index
+
+    # state referring to the DOM, not part of snapshots
+    domAttributes = ('index', 'stereotypeIndexes', 'datatypes',
+                     'tagDefinitions')
+
+    def detach(self):
+        """Drop the references to the DOM gathered while building.
+        """
+        self.index = None
+        self.stereotypeIndexes = {}
+        self.datatypes = {}
+        self.tagDefinitions = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self.domAttributes:
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(**state)
 
     def getName(self, domElement, doReplace=False):
-        name = getAttributeValue(domElement, self.__name__)
+        name = getAttributeValue(domElement, self.NAME)
         return normalize(name, doReplace)
     
     def getId(self, domElement):
@@ -143,12 +196,12 @@ class XMI1_0(object):
 
     def getAssocEndParticipantId(self, el):
         assocend = getElementByTagName(el, self.ASSOCEND_PARTICIPANT, None)
-        if not assocend:
+        if assocend is None:
             assocend = getElementByTagName(el, self.ASSOCENDTYPE, None)
-            if not assocend:
+            if assocend is None:
                 return None
         classifier = getSubElement(assocend)
-        if not classifier:
+        if classifier is None:
             log.warn("No assocEnd participant found  for '%s'.",
                      self.getId(el))
             return None
@@ -180,10 +233,24 @@ class XMI1_0(object):
                                          recursive=1))
         return (mult_min, mult_max)
 
-    def buildRelations(self, doc, objects):
+    def getOwner(self, el):
+        """Return the element built for the nearest ancestor of el.
+        """
+        parent = el.parentNode
+        while parent is not None and \
+              getattr(parent, 'xmiElement', None) is None:
+            parent = parent.parentNode
+        if parent is None:
+            return None
+        return parent.xmiElement
+
+    def buildRelations(self, doc, objects, rels=None):
+        """Build the associations of doc, or the ones in rels.
+        """
         #XXX: needs refactoring
-        rels = doc.getElementsByTagName(self.ASSOCIATION) + \
-               doc.getElementsByTagName(self.ASSOCIATION_CLASS)
+        if rels is None:
+            rels = self.getIndex(doc).getElementsByTagName(
+                [self.ASSOCIATION, self.ASSOCIATION_CLASS])
         for rel in rels:
             master = None
             detail = None
@@ -198,6 +265,16 @@ class XMI1_0(object):
             else:
                 associationXMIClass = XMIAssociation
 
+            relid = str(self.getId(rel))
+            participants = [self.getAssocEndParticipantId(end)
+                            for end in ends]
+            missing = [pid for pid in participants
+                       if pid and objects.get(str(pid)) is None]
+            if missing:
+                log.warn("Object not found for association '%s': '%s'.",
+                         relid, missing[0])
+                continue
+
             if self.isAssocEndAggregation(ends[0]):
                 master = ends[0]
                 detail = ends[1]
@@ -205,72 +282,47 @@ class XMI1_0(object):
                 master = ends[1]
                 detail = ends[0]
 
-            if master:
+            if master is not None:
                 log.debug("Ok, weve found an aggregation.")
                 log.debug("It's an %s", associationXMIClass)
                 masterid = self.getAssocEndParticipantId(master)
                 detailid = self.getAssocEndParticipantId(detail)
-
-                log.debug("Master '%s', detail '%s'.", master, detail)
-                m = objects.get(masterid, None)
-                d = objects.get(detailid, None)
-                log.debug("In other words: Master id='%s', Master name='%s'.", 
-                          self.getId(master), m.getName())
-
-                if not m:
-                    log.warn("Master Object not found for aggregation "
-                             "relation id='%s'.", self.getId(master))
+                m = objects.get(str(masterid))
+                d = objects.get(str(detailid))
+                if m is None or d is None:
+                    log.warn("Object not found for aggregation relation "
+                             "id='%s'.", relid)
                     continue
-
-                if not d:
-                    log.warn("Child Object not found for aggregation "
-                             "relation: parent='%s'.", m.getName())
-                    continue
-
-                try:
-                    m.addSubType(d)
-                except KeyError:
-                    log.warn("Child Object not found for aggregation "
-                             "relation: Child=%s(%s), parent=%s.",
-                             d.getId(), d.getName(), self.getName(m))
+                log.debug("Master '%s', detail '%s'.", m.__name__,
+                          d.__name__)
+                m.addSubType(d)
+            else:
+                log.debug("It's an assoc, lets model it as association or "
+                          "an association class.")
+
+            # check whether this association (class) already exists or we
+            # have to instantiate it
+            assoc = objects.get(relid)
+            if assoc is not None:
+                assoc._buildEnds()
+            else:
+                owner = self.getOwner(rel)
+                if owner is None:
+                    log.warn("Association outside of the model: '%s'.",
+                             relid)
                     continue
+                assoc = associationXMIClass(self.getName(rel), rel)
+                assoc.initialize(owner)
 
-                # check whether this association already exists or we have to 
-                # instantiate it
-                relid = self.getId(rel)
-                if allObjects.has_key(relid):
-                    assoc = allObjects[relid]
-                else:
-                    assoc = associationXMIClass(rel)
+            if assoc.fromEnd.obj is not None and \
+               assoc.toEnd.obj is not None:
                 assoc.fromEnd.obj.addAssocFrom(assoc)
                 assoc.toEnd.obj.addAssocTo(assoc)
-
             else:
-                log.debug("It's an assoc, lets model it as association or an association class.")
-                try:
-                    #check if an association class already exists
-                    relid = self.getId(rel)
-                    if allObjects.has_key(relid):
-                        assoc = allObjects[relid]
-                        assoc.calcEnds()
-                    else:
-                        assoc = associationXMIClass(rel)
-                except KeyError:
-                    log.warn("Child Object not found for aggregation "
-                             "'%s', parent='%s'.",
-                             self.getId(rel), self.getName(master))
-                    continue
-
-                if getattr(assoc.fromEnd, 'obj', None) and \
-                   getattr(assoc.toEnd, 'obj', None):
-                    assoc.fromEnd.obj.addAssocFrom(assoc)
-                    assoc.toEnd.obj.addAssocTo(assoc)
-                else:
-                    log.warn("Association has no ends: '%s'.",
-                             assoc.getId())
+                log.warn("Association has no ends: '%s'.", relid)
 
     def buildGeneralizations(self, doc, objects):
-        gens = doc.getElementsByTagName(self.GENERALIZATION)
+        gens = self.getIndex(doc).getElementsByTagName(self.GENERALIZATION)
 
         for gen in gens:
             if not self.getId(gen):continue
@@ -278,15 +330,13 @@ class XMI1_0(object):
                 par0 = getElementByTagName(gen, self.GEN_PARENT, recursive=1)
                 child0 = getElementByTagName(gen, self.GEN_CHILD, recursive=1)
                 try:
-                    par = objects[getSubElement(par0).getAttribute('xmi.idref')]
+                    par = objects[str(getSubElement(par0).getAttribute('xmi.idref'))]
+                    child = objects[str(getSubElement(child0).getAttribute('xmi.idref'))]
                 except KeyError:
-                    log.warn("Parent Object not found for generalization "
-                             "relation '%s', parent=%s'.",
-                             self.getId(gen), self.getName(par0))
+                    log.warn("Object not found for generalization "
+                             "relation '%s'.", self.getId(gen))
                     continue
 
-                child = objects[getSubElement(child0).getAttribute('xmi.idref')]
-
                 par.addGenChild(child)
                 child.addGenParent(par)
             except IndexError:
@@ -294,42 +344,53 @@ class XMI1_0(object):
                           self.getId(gen))
                 raise
 
-    def buildRealizations(self, doc, objects):
-        abs = doc.getElementsByTagName(self.ABSTRACTION)
+    def buildRealizations(self, doc, objects, abs=None):
+        """Build the realizations and adaptations of doc, or the ones in
+        abs.
+        """
+        if abs is None:
+            abs = self.getIndex(doc).getElementsByTagName(self.ABSTRACTION)
         for ab in abs:
             if not self.getId(ab): continue
-            abstraction = XMIAbstraction(ab)
-            if not abstraction.hasStereoType('realize') and \
-               not abstraction.hasStereoType('adapts'):
-                log.debug("Skipping dep: %s", abstraction.getStereoType())
+            owner = self.getOwner(ab)
+            if owner is None:
+                log.warn("Abstraction outside of the model: '%s'.",
+                         self.getId(ab))
+                continue
+            abstraction = XMIAbstraction(self.getName(ab), ab)
+            abstraction.initialize(owner)
+            if not abstraction.hasStereotype('realize') and \
+               not abstraction.hasStereotype('adapts'):
+                log.debug("Skipping dep: %s", abstraction.stereotypes)
                 continue
             try:
                 try:
                     par0 = getElementByTagName(ab, self.DEP_SUPPLIER,
                                                recursive=1)
                     sub = getSubElement(par0, ignoremult=1)
-                    par = objects[sub.getAttribute('xmi.idref')]
+                    par = objects[str(sub.getAttribute('xmi.idref'))]
                 except (KeyError, IndexError):
-                    log.warn("Parent Object not found for realization or adaptation "
-                             "relation:%s, parent %s.",
-                             self.getId(ab), self.getName(par0))
+                    log.warn("Parent Object not found for realization or "
+                             "adaptation relation '%s'.", self.getId(ab))
                     continue
 
                 try:
                     child0 = getElementByTagName(ab, self.DEP_CLIENT,
                                                  recursive=1)
                     sub = getSubElement(child0, ignoremult=1)
-                    child_xmid = sub.getAttribute('xmi.idref')
+                    child_xmid = str(sub.getAttribute('xmi.idref'))
                     child = objects[child_xmid]
                 except (KeyError, IndexError):
-                    log.warn("Child element for realization or adaptation relation not found. "
-                             "Parent name = '%s' relation xmi_id = '%s'.",
-                             par.getName(), self.getId(ab))
+                    log.warn("Child element for realization or adaptation "
+                             "relation not found. Parent name = '%s' "
+                             "relation xmi_id = '%s'.",
+                             par.__name__, self.getId(ab))
+                    continue
 
-                if abstraction.hasStereoType('realize'):
+                if abstraction.hasStereotype('realize'):
                     par.addRealizationChild(child)
                     child.addRealizationParent(par)
-                if abstraction.hasStereoType('adapts'):
+                if abstraction.hasStereotype('adapts'):
                     par.addAdaptationChild(child)
                     child.addAdaptationParent(par)
             except IndexError:
@@ -337,15 +398,20 @@ class XMI1_0(object):
                           self.getId(ab))
                 raise
 
-    def buildDependencies(self, doc, objects):
-        deps = doc.getElementsByTagName(self.DEPENDENCY)
+    def buildDependencies(self, doc, objects, deps=None):
+        """Build the dependencies of doc, or the ones in deps.
+        """
+        if deps is None:
+            deps = self.getIndex(doc).getElementsByTagName(self.DEPENDENCY)
         for dep in deps:
             if not self.getId(dep):continue
-            try:
-                depencency = XMIDependency(dep, allObjects=objects)
-            except KeyError:
-                log.warn('couldnt resolve dependency relation %s',
-                         dep.getAttribute('xmi.id'))
+            owner = self.getOwner(dep)
+            if owner is None:
+                log.warn("Dependency outside of the model: '%s'.",
+                         self.getId(dep))
+                continue
+            dependency = XMIDependency(self.getName(dep), dep)
+            dependency.initialize(owner)
 
     def getExpressionBody(self, element, tagname = None):
         if not tagname:
@@ -373,23 +439,37 @@ class XMI1_0(object):
     def collectTagDefinitions(self, el, **kw):
         raise NotImplementedError, 'Only needed in xmi >=1.1'
 
+    def getStereotypeIndex(self, doc):
+        """Return a dict mapping the ids of the elements of doc to the names
+        of their stereotypes, built on first use.
+        """
+        try:
+            return self.stereotypeIndexes[self.getIndex(doc)]
+        except KeyError:
+            pass
+        # in xmi 1.0 all objects to which a stereotype applies are stored in
+        # the stereotype, while in xmi 1.2 it's the opposite
+        stereotypes = {}
+        for st in self.getIndex(doc).getElementsByTagName(self.STEREOTYPE):
+            name = self.getName(st)
+            for el in st.getElementsByTagName(self.MODELELEMENT):
+                names = stereotypes.setdefault(
+                    str(el.getAttribute('xmi.idref')), [])
+                if name not in names:
+                    names.append(name)
+        self.stereotypeIndexes[self.getIndex(doc)] = stereotypes
+        return stereotypes
+
     def calculateStereoType(self, o):
-        # in xmi its weird, because all objects to which a
-        # stereotype applies are stored in the stereotype
-        # while in xmi 1.2 its opposite
-        for k in stereotypes.keys():
-            st = stereotypes[k]
-            els = st.getElementsByTagName(self.MODELELEMENT)
-            for el in els:
-                if el.getAttribute('xmi.idref') == o.getId():
-                    name = self.getName(st)
-                    log.debug("Stereotype found: %s.",
-                              name)
-                    o.setStereoType(name)
+        stereotypes = self.getStereotypeIndex(o.domElement.ownerDocument)
+        for name in stereotypes.get(o.id, ()):
+            log.debug("Stereotype found: %s.", name)
+            if name not in o.stereotypes:
+                o.stereotypes.append(name)
 
     def calcClassAbstract(self, o):
         abs = getElementByTagName(o.domElement, self.ISABSTRACT, None)
-        if abs:
+        if abs is not None:
             o.isabstract = abs.getAttribute('xmi.value') == 'true'
         else:
             o.isabstract = 0
@@ -403,25 +483,24 @@ class XMI1_0(object):
         o.ownerScope = None
 
     def calcDatatype(self, att):
-        global datatypes
         typeinfos = att.domElement.getElementsByTagName(self.TYPE)
         if len(typeinfos):
             classifiers = typeinfos[0].getElementsByTagName(self.CLASSIFIER)
             if len(classifiers):
                 typeid = str(self.getIdRefOrHrefId(classifiers[0]))
-                typeElement = datatypes[typeid]
+                typeElement = self.datatypes[typeid]
                 att.type = self.getName(typeElement)
                 # Collects all datatype names (to prevent pure datatype
                 # classes from being generated)
-                if att.type not in datatypenames:
-                    datatypenames.append(att.type)
+                if att.type not in self.datatypenames:
+                    self.datatypenames.append(att.type)
 
     def getPackageElements(self, el):
         """Gets all package nodes below the current node (only one level)."""
         res = []
         #in case the el is a document we have to crawl down until we have ownedElements
         ownedElements = getElementByTagName(el, self.OWNED_ELEMENT, default=None)
-        if not ownedElements:
+        if ownedElements is None:
             if el.tagName == self.PACKAGE:
                 return []
             el = getElementByTagName(el, self.MODEL, recursive=1)
@@ -433,16 +512,16 @@ class XMI1_0(object):
         return getElementByTagName(el, self.OWNED_ELEMENT, default=None)
 
     def getContent(self, doc):
-        return getElementByTagName(doc, self.XMI_CONTENT, recursive=1)
+        return self.getIndex(doc).getElementByTagName(self.XMI_CONTENT)
 
     def getModel(self, doc):
         content = self.getContent(doc)
         try:
-            model = getElementByTagName(content, XMI.MODEL, recursive=0)
+            model = getElementByTagName(content, self.MODEL, recursive=0)
         except TypeError:
             #handle a bug in ArgoUML that causes 2 model entries in the xmi
             #from which one is empty
-            models = getElementsByTagName(content, XMI.MODEL, recursive=0)
+            models = getElementsByTagName(content, self.MODEL, recursive=0)
             model=models[1]
             
         return model
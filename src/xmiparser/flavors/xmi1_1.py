@@ -44,7 +44,7 @@ class XMI1_1(XMI1_0):
     GEN_ELEMENT = "UML:Class"
 
     ATTRIBUTE_INIT_VALUE = "UML:Attribute.initialValue"
-    EXPRESSION = ["UML:Expression","UML2:OpaqueExpression"]
+    EXPRESSION = ("UML:Expression", "UML2:OpaqueExpression")
     PARAM_DEFAULT = "UML:Parameter.defaultValue"
 
     TAG_DEFINITION = "UML:TagDefinition"
@@ -68,32 +68,42 @@ class XMI1_1(XMI1_0):
     DEP_SUPPLIER = "UML:Dependency.supplier"
 
     ASSOCIATION_CLASS = 'UML:AssociationClass'
-    BOOLEAN_EXPRESSION = ["UML:BooleanExpression","UML2:OpaqueExpression"]
+    BOOLEAN_EXPRESSION = ("UML:BooleanExpression",
+                          "UML2:OpaqueExpression")
 
     #State Machine
 
-    STATEMACHINE = "UML:StateMachine","UML2:StateMachine"
+    STATEMACHINE = ("UML:StateMachine", "UML2:StateMachine")
     STATEMACHINE_CONTEXT = "UML:StateMachine.context"
     STATEMACHINE_TOP = "UML:StateMachine.top"
     COMPOSITESTATE = "UML:CompositeState"
     COMPOSITESTATE_SUBVERTEX = "UML:CompositeState.subvertex"
-    SIMPLESTATE = "UML:SimpleState","UML2:State"
-    PSEUDOSTATE = "UML:Pseudostate", "UML2:PseudoState", "UML2:Pseudostate"
+    SIMPLESTATE = ("UML:SimpleState", "UML2:State")
+    PSEUDOSTATE = ("UML:Pseudostate",
+                   "UML2:PseudoState",
+                   "UML2:Pseudostate")
     PSEUDOSTATE_KIND = "kind"
-    FINALSTATE = "UML:FinalState","UML2:FinalState"
-    STATEVERTEX_OUTGOING = "UML:StateVertex.outgoing","UML2:Vertex.outgoing"
-    STATEVERTEX_INCOMING = "UML:StateVertex.incoming","UML2:Vertex.incoming"
-    TRANSITION = "UML:Transition","UML2:Transition"
+    FINALSTATE = ("UML:FinalState", "UML2:FinalState")
+    STATEVERTEX_OUTGOING = ("UML:StateVertex.outgoing",
+                            "UML2:Vertex.outgoing")
+    STATEVERTEX_INCOMING = ("UML:StateVertex.incoming",
+                            "UML2:Vertex.incoming")
+    TRANSITION = ("UML:Transition", "UML2:Transition")
     STATEMACHINE_TRANSITIONS = "UML:StateMachine.transitions"
-    TRANSITON_TARGET = "UML:Transition.target","UML2:Transition.target"
-    TRANSITION_SOURCE = "UML:Transition.source","UML2:Transition.source"
-    TRANSITION_EFFECT = "UML:Transition.effect","UML2:Transition.effect"
-    TRANSITION_GUARD = "UML:Transition.guard", "UML2:Transition.guard"
+    TRANSITON_TARGET = ("UML:Transition.target",
+                        "UML2:Transition.target")
+    TRANSITION_SOURCE = ("UML:Transition.source",
+                         "UML2:Transition.source")
+    TRANSITION_EFFECT = ("UML:Transition.effect",
+                         "UML2:Transition.effect")
+    TRANSITION_GUARD = ("UML:Transition.guard",
+                        "UML2:Transition.guard")
     OWNED_BEHAVIOR = "UML2:BehavioredClassifier.ownedBehavior"
 
-    ACTION_SCRIPT = "UML:Action.script", "UML2:OpaqueBehavior"
+    ACTION_SCRIPT = ("UML:Action.script", "UML2:OpaqueBehavior")
     ACTION_EXPRESSION = "UML:ActionExpression"
-    ACTION_EXPRESSION_BODY = "UML:ActionExpression.body", "UML2:OpaqueBehavior.body"
+    ACTION_EXPRESSION_BODY = ("UML:ActionExpression.body",
+                              "UML2:OpaqueBehavior.body")
 
     DIAGRAM = "UML:Diagram"
     DIAGRAM_OWNER = "UML:Diagram.owner"
@@ -105,7 +115,7 @@ class XMI1_1(XMI1_0):
 
     def getName(self, domElement, doReplace=False):
         name = ''
-        if domElement:
+        if domElement is not None:
             name = normalize(domElement.getAttribute('name'), doReplace)
         return name
 
@@ -113,7 +123,7 @@ class XMI1_1(XMI1_0):
         if not tagname:
             tagname = self.EXPRESSION
         exp = getElementByTagName(element, tagname, recursive=1, default=None)
-        if exp:
+        if exp is not None:
             return exp.getAttribute('body')
         else:
             return None
\ No newline at end of file
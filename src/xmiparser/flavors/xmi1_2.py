@@ -1,9 +1,16 @@
 # Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
 # GNU General Public License Version 2 or later
 
+import logging
 from xmi1_1 import XMI1_1 
+from xmiparser.utils import normalize
+from xmiparser.xmiutils import getSubElements
+from xmiparser.xmiutils import getAttributeValue
+from xmiparser.xmiutils import getElementByTagName
 from xmiparser.xmiutils import getElementsByTagName
 
+log = logging.getLogger('XMIparser')
+
 class XMI1_2(XMI1_1):
     TAGGED_VALUE_VALUE = "UML:TaggedValue.dataValue"
     # XMI version specific stuff goes there
@@ -26,8 +33,8 @@ class XMI1_2(XMI1_1):
     def getMultiplicity(self, el, multmin=0, multmax=-1):
         min = getElementByTagName(el, self.MULTRANGE, default=None, recursive=1)
         max = getElementByTagName(el, self.MULTRANGE, default=None, recursive=1)
-        mult_min = int(min.getAttribute('lower')) if min else multmin
-        mult_max = int(max.getAttribute('upper')) if max else multmax
+        mult_min = int(min.getAttribute('lower')) if min is not None else multmin
+        mult_max = int(max.getAttribute('upper')) if max is not None else multmax
         return (mult_min, mult_max)
 
     def getTaggedValue(self, el):
@@ -46,31 +53,41 @@ class XMI1_2(XMI1_1):
         return tagname, tagvalue
 
     def collectTagDefinitions(self, el, prefix=''):
-        tagdefs = el.getElementsByTagName(self.TAG_DEFINITION)
+        tagdefs = self.getIndex(el).getElementsByTagName(self.TAG_DEFINITION)
         if self.tagDefinitions is None:
             self.tagDefinitions = {}
         for t in tagdefs:
             if t.hasAttribute('name'):
                 self.tagDefinitions[prefix + t.getAttribute('xmi.id')] = t
 
-    def calculateStereoType(self, o):
-        # In xmi its weird, because all objects to which a stereotype
-        # applies are stored in the stereotype while in xmi 1.2 its opposite
-
-        sts = getElementsByTagName(o.domElement, self.STEREOTYPE_MODELELEMENT,
-                                   recursive=0)
-        for st in sts:
-            strefs = getSubElements(st)
-            for stref in strefs:
-                id = self.getIdRefOrHrefId(stref)
-                if id:
-                    st = stereotypes[id]
-                    o.addStereoType(self.getName(st).strip())
-                    log.debug("Stereotype found: id='%s', name='%s'.",
-                              id, self.getName(st))
-                else:
-                    log.warn("Empty stereotype id='%s' for class '%s'",
-                             o.getId(), o.getName())
+    def getStereotypeIndex(self, doc):
+        """Return a dict mapping the ids of the elements of doc to the names
+        of their stereotypes, built on first use.
+        """
+        try:
+            return self.stereotypeIndexes[self.getIndex(doc)]
+        except KeyError:
+            pass
+        # in xmi 1.2 the elements refer to their stereotypes
+        index = self.getIndex(doc)
+        names = {}
+        for st in index.getElementsByTagName(self.STEREOTYPE):
+            stid = self.getId(st)
+            if stid:
+                names[str(stid)] = self.getName(st).strip()
+        stereotypes = {}
+        for sts in index.getElementsByTagName(self.STEREOTYPE_MODELELEMENT):
+            elid = str(self.getId(sts.parentNode))
+            for stref in getSubElements(sts):
+                name = names.get(str(self.getIdRefOrHrefId(stref)))
+                if name is None:
+                    log.warn("Unknown stereotype for element id='%s'.", elid)
+                    continue
+                elnames = stereotypes.setdefault(elid, [])
+                if name not in elnames:
+                    elnames.append(name)
+        self.stereotypeIndexes[self.getIndex(doc)] = stereotypes
+        return stereotypes
 
     def calcClassAbstract(self, o):
         o.isabstract = o.domElement.hasAttribute('isAbstract') and \
@@ -85,7 +102,6 @@ class XMI1_2(XMI1_1):
                        o.domElement.getAttribute('ownerScope')
 
     def calcDatatype(self, att):
-        global datatypes
         typeinfos = att.domElement.getElementsByTagName(self.TYPE) + \
                     att.domElement.getElementsByTagName(self.UML2TYPE)
         if len(typeinfos):
@@ -94,11 +110,16 @@ class XMI1_2(XMI1_1):
             if len(classifiers):
                 typeid = self.getIdRefOrHrefId(classifiers[0])
                 try:
-                    typeElement = datatypes[typeid]
+                    typeElement = self.datatypes[typeid]
                 except KeyError:
+                    if not self.getIdRef(classifiers[0]):
+                        # defined in a profile we could not read
+                        log.warn("Datatype '%s' of '%s' not found.",
+                                 typeid, att.__name__)
+                        return
                     raise ValueError, 'datatype %s not defined' % typeid
                 att.type = self.getName(typeElement)
                 # Collect all datatype names (to prevent pure datatype
                 # classes from being generated)
-                if att.type not in datatypenames:
-                    datatypenames.append(att.type)
\ No newline at end of file
+                if att.type not in self.datatypenames:
+                    self.datatypenames.append(att.type)
\ No newline at end of file
@@ -16,10 +16,35 @@ class IModelFactory(Interface):
     """Factory for ``IXMIModel`` implementing instance.
     """
     
+    backend = Attribute(u"the IParserBackend used to read the source")
+
+    cache = Attribute(u"ParseCache keeping snapshots of parsed models or None")
+
+    detach = Attribute(u"whether models are detached from their DOM after "
+                       u"they are built")
+
+    filter = Attribute(u"ParseFilter of what is dropped while parsing or None")
+
+    lazy = Attribute(u"whether packages are built when first accessed")
+    
     def __call__(sourcepath):
         """Create and return ``IXMIModel`` implementing instance.
         
-        @param sourcepath: Source path of *.xmi, *.zargo, *.zuml
+        Safe to call from several threads at the same time.
+        
+        @param sourcepath: path of a *.xmi, *.zargo or *.zuml file, the
+                           content of one as string or a file object. gzip,
+                           bz2 and xz compressed input is decompressed.
+        """
+
+class IParserBackend(Interface):
+    """Reads XMI sources into a DOM document.
+    """
+    
+    def parse(source):
+        """Parse source and return a ``xml.dom.minidom`` compatible document.
+        
+        @param source: file path or file like object
         """
 
 ###############################################################################   
@@ -57,6 +82,9 @@ class IXMIElement(IAttributeAnnotatable):
     
     id = Attribute(u"XMI: identifier. string expected")
 
+    qualifiedName = Attribute(u"dotted names of the element and its owners, "
+                              u"without the model")
+
     maxOccurs = Attribute(u"UML: maximum occurencies. integer expected.")
     
     isComplex = Attribute(u"UML: complex or not. boolean expected")
@@ -87,6 +115,55 @@ class IXMIModel(IXMIPackage):
     """An XMI Model.
     """
 
+    def detach():
+        """Drop all references to the DOM the model was built from.
+
+        Values read while building stay available on the elements.
+        """
+
+    def load():
+        """Build all packages of a lazy model not built yet, then the
+        diagrams and the state machine links of the eager build.
+
+        Stereotype and tagged value queries load the model first.
+        """
+
+    def resolve(xmiid):
+        """Build the packages containing the element with xmiid and return
+        the element, or None if there is none.
+        """
+
+    def getElementsByStereotype(stereotype, iface=None):
+        """Return all elements with stereotype.
+
+        Answered from an index kept while building, in O(result).
+        """
+
+    def getElementsByTaggedValue(tag, value=None, iface=None):
+        """Return all elements having the tagged value tag, with value if
+        given.
+
+        Answered from an index kept while building, in O(result).
+        """
+
+    def lookup(qualifiedName, default=None):
+        """Return the package, class, interface, attribute or operation with
+        the dotted qualifiedName, relative to the model.
+
+        Raises KeyError if there is none and no default is given.
+        """
+
+    def reindex(element=None):
+        """Update the query index after stereotypes, tagged values or names
+        changed.
+        """
+
+    def prepareDocumentation(striphtml=0, wrap=-1, workers=None,
+                             processes=False):
+        """Format the documentation of all elements at once, optionally in a
+        pool of worker threads or processes.
+        """
+
 class IXMIClass(IXMIElement, IXMIStateMachineContainer):
     """XXX
     """
@@ -0,0 +1,188 @@
+# Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
+# GNU General Public License Version 2 or later
+
+from xml.dom import Node
+from lxml import etree
+
+_xpaths = {}
+
+def compileXPath(tagNames, recursive, nsmap, includeSelf=False):
+    """Return a compiled XPath matching child or descendant elements.
+
+    Recursive lookups of several tag names are returned grouped by tag name,
+    like consecutive ``getElementsByTagName`` calls would, all others are in
+    document order.
+    """
+    namespaces = dict([(k, v) for k, v in nsmap.items() if k])
+    key = (tagNames, recursive, includeSelf, tuple(sorted(namespaces.items())))
+    try:
+        return _xpaths[key]
+    except KeyError:
+        pass
+    if recursive:
+        axis = includeSelf and 'descendant-or-self' or 'descendant'
+    else:
+        axis = 'child'
+    steps = []
+    for tagName in tagNames:
+        if ':' in tagName and tagName.split(':', 1)[0] not in namespaces:
+            # prefix not declared in the document, can't match
+            continue
+        steps.append('%s::%s' % (axis, tagName))
+    if not steps:
+        xpath = None
+    elif recursive and len(steps) > 1:
+        xpath = [etree.XPath(step, namespaces=namespaces) for step in steps]
+    else:
+        xpath = etree.XPath(' | '.join(steps), namespaces=namespaces)
+    _xpaths[key] = xpath
+    return xpath
+
+def findElements(node, tagNames, recursive, includeSelf=False):
+    xpath = compileXPath(tagNames, recursive, node.nsmap,
+                         includeSelf=includeSelf)
+    if xpath is None:
+        return []
+    if isinstance(xpath, list):
+        res = []
+        for x in xpath:
+            res.extend(x(node))
+        return res
+    return xpath(node)
+
+class Text(object):
+    """Text node.
+    """
+    nodeType = Node.TEXT_NODE
+    ELEMENT_NODE = Node.ELEMENT_NODE
+    TEXT_NODE = Node.TEXT_NODE
+    childNodes = ()
+    firstChild = None
+
+    def __init__(self, data):
+        self.data = self.nodeValue = unicode(data)
+
+class Element(etree.ElementBase):
+    """lxml element providing the part of the ``xml.dom`` API xmiparser uses.
+
+    Tag name lookups run as XPath expressions, compiled once per tag names
+    and namespace declarations.
+    """
+    nodeType = Node.ELEMENT_NODE
+    ELEMENT_NODE = Node.ELEMENT_NODE
+    TEXT_NODE = Node.TEXT_NODE
+
+    @property
+    def tagName(self):
+        if self.prefix:
+            return u'%s:%s' % (self.prefix, etree.QName(self).localname)
+        return unicode(self.tag)
+
+    nodeName = tagName
+
+    @property
+    def parentNode(self):
+        return self.getparent()
+
+    @property
+    def ownerDocument(self):
+        return getattr(self.getroottree().getroot(), 'xmiDocument', None)
+
+    @property
+    def childNodes(self):
+        nodes = []
+        if self.text:
+            nodes.append(Text(self.text))
+        for child in self:
+            if isinstance(child, Element):
+                nodes.append(child)
+            if child.tail:
+                nodes.append(Text(child.tail))
+        return nodes
+
+    @property
+    def firstChild(self):
+        if self.text:
+            return Text(self.text)
+        for child in self:
+            if isinstance(child, Element):
+                return child
+        return None
+
+    def getAttribute(self, name):
+        return unicode(self.get(name, u''))
+
+    def hasAttribute(self, name):
+        return name in self.attrib
+
+    def getElementsByTagName(self, tagName):
+        return findElements(self, (tagName,), True)
+
+    def findElementsByTagNames(self, tagNames, recursive):
+        return findElements(self, tagNames, recursive)
+
+class Document(object):
+    """Document node wrapping the parsed element tree.
+    """
+    nodeType = Node.DOCUMENT_NODE
+    ELEMENT_NODE = Node.ELEMENT_NODE
+    TEXT_NODE = Node.TEXT_NODE
+    parentNode = None
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.documentElement = tree.getroot()
+        # the proxy of the root lives as long as the document refers to it
+        self.documentElement.xmiDocument = self
+
+    @property
+    def childNodes(self):
+        return [self.documentElement]
+
+    firstChild = property(lambda self: self.documentElement)
+
+    def iterElements(self):
+        return self.documentElement.iter(tag=etree.Element)
+
+    def getElementsByTagName(self, tagName):
+        return self.findElementsByTagNames((tagName,), True)
+
+    def findElementsByTagNames(self, tagNames, recursive):
+        root = self.documentElement
+        if not recursive:
+            return root.tagName in tagNames and [root] or []
+        return findElements(root, tagNames, True, includeSelf=True)
+
+def parse(source, filter=None):
+    """Parse source, dropping what the ``ParseFilter`` filter asks for.
+    """
+    if filter is None:
+        parser = etree.XMLParser(remove_blank_text=True)
+    else:
+        parser = etree.XMLParser(remove_blank_text=filter.whitespace,
+                                 remove_comments=filter.comments)
+    parser.set_element_class_lookup(
+        etree.ElementDefaultClassLookup(element=Element))
+    document = Document(etree.parse(source, parser))
+    if filter is not None and filter.ignore:
+        ignored = [el for el in document.iterElements()
+                   if el.tagName in filter.ignore]
+        for el in ignored:
+            if el.getparent() is not None:
+                removeElement(el)
+    return document
+
+def removeElement(el):
+    """Remove el from its parent, keeping the text following it.
+
+    lxml stores that text as the ``tail`` of el, it moves to the previous
+    sibling or to the text of the parent.
+    """
+    parent = el.getparent()
+    if el.tail:
+        previous = el.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + el.tail
+        else:
+            parent.text = (parent.text or '') + el.tail
+    parent.remove(el)
@@ -0,0 +1,322 @@
+# Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
+# GNU General Public License Version 2 or later
+
+import re
+import bz2
+import zlib
+import logging
+import os.path
+from collections import deque
+from zipfile import ZipFile
+from cStringIO import StringIO
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+log = logging.getLogger('XMIparser')
+
+CHUNK_SIZE = 65536
+
+# bytes read ahead to tell XMI version and exporter
+HEADER_SIZE = 8192
+
+GZIP = '\x1f\x8b'
+BZIP2 = 'BZh'
+XZ = '\xfd7zXZ\x00'
+ZIP = 'PK\x03\x04'
+
+def _gzipDecompressor():
+    # 16 + MAX_WBITS expects a gzip header and trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _xzDecompressor():
+    if lzma is None:
+        raise ValueError, 'Reading xz compressed input needs the lzma module'
+    return lzma.LZMADecompressor()
+
+DECOMPRESSORS = [
+    (GZIP, 'gzip', _gzipDecompressor),
+    (BZIP2, 'bz2', bz2.BZ2Decompressor),
+    (XZ, 'xz', _xzDecompressor),
+]
+
+class PeekableFile(object):
+    """Read only file object which can look ahead without consuming.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.head = ''
+
+    def peek(self, size):
+        while len(self.head) < size:
+            chunk = self.fileobj.read(size - len(self.head))
+            if not chunk:
+                break
+            self.head += chunk
+        return self.head[:size]
+
+    def read(self, size=-1):
+        if not self.head:
+            return self.fileobj.read(size)
+        if size < 0:
+            data = self.head + self.fileobj.read()
+            self.head = ''
+        else:
+            data, self.head = self.head[:size], self.head[size:]
+        return data
+
+class DecompressingFile(object):
+    """Read only file object decompressing a stream on the fly.
+
+    Concatenated streams, like the members of a gzip file, are read one after
+    the other. Decompressed data is kept as a list of chunks and an offset
+    into the first one, reads don't copy what stays buffered.
+    """
+
+    def __init__(self, fileobj, factory):
+        self.fileobj = fileobj
+        self.factory = factory
+        self.decompressor = factory()
+        # compressed data not decompressed yet
+        self.input = ''
+        self.chunks = deque()
+        self.offset = 0
+        self.buffered = 0
+        self.eof = False
+
+    def read(self, size=-1):
+        while size < 0 or self.buffered < size:
+            data = self._decompress()
+            if data is None:
+                break
+            if data:
+                self.chunks.append(data)
+                self.buffered += len(data)
+        if size < 0 or size > self.buffered:
+            size = self.buffered
+        out = []
+        needed = size
+        while needed:
+            chunk = self.chunks[0]
+            end = self.offset + needed
+            if end < len(chunk):
+                out.append(chunk[self.offset:end])
+                self.offset = end
+                break
+            out.append(self.offset and chunk[self.offset:] or chunk)
+            needed -= len(chunk) - self.offset
+            self.chunks.popleft()
+            self.offset = 0
+        self.buffered -= size
+        return ''.join(out)
+
+    def _decompress(self):
+        """Return the next piece of decompressed data, None at the end.
+        """
+        if not self.input:
+            if self.eof:
+                return None
+            self.input = self.fileobj.read(CHUNK_SIZE)
+            if not self.input:
+                self.eof = True
+                return None
+        decompressor = self.decompressor
+        try:
+            if hasattr(decompressor, 'unconsumed_tail'):
+                # zlib bounds the output, the rest of the input stays
+                data = decompressor.decompress(self.input, CHUNK_SIZE)
+                self.input = decompressor.unconsumed_tail
+            else:
+                data = decompressor.decompress(self.input)
+                self.input = ''
+        except EOFError:
+            # the last stream ended exactly at the end of a chunk
+            self.decompressor = self.factory()
+            return ''
+        if decompressor.unused_data:
+            # another stream follows, zlib leaves it in the tail as well
+            self.input = decompressor.unused_data
+            self.decompressor = self.factory()
+        return data
+
+_declaration = re.compile(r'^(\s*<\?xml[^>]*?encoding\s*=\s*)([\'"])[^\'"]*\2')
+
+def isData(source):
+    """Whether the string source is a document rather than a path.
+    """
+    if isinstance(source, unicode):
+        return source.lstrip(u'\ufeff \t\r\n').startswith(u'<')
+    if not isinstance(source, str):
+        return False
+    for magic in (GZIP, BZIP2, XZ, ZIP):
+        if source.startswith(magic):
+            return True
+    return source.lstrip('\xef\xbb\xbf \t\r\n').startswith('<')
+
+def encodeDocument(source):
+    """Return the unicode document source encoded as UTF-8, with the
+    encoding of its XML declaration changed to match.
+    """
+    source = source.lstrip(u'\ufeff')
+    return _declaration.sub(r'\1\2UTF-8\2', source, 1).encode('utf-8')
+
+_root = re.compile(r'<(XMI|[\w.-]+:XMI)(\s[^>]*)?>')
+_attribute = re.compile(r'([\w.:-]+)\s*=\s*([\'"])(.*?)\2', re.S)
+_version = re.compile(r'\sxmi:version\s*=\s*([\'"])(.*?)\1')
+_namespace = re.compile(r'\sxmlns:([\w.-]+)\s*=\s*([\'"])(.*?)\2')
+_exporter = re.compile(r'<XMI.exporter>(.*?)</XMI.exporter>', re.S)
+
+class XMIHeader(object):
+    """What the first bytes of a document tell about it.
+
+    ``version`` is the XMI version, or None if it wasn't found. ``exporter``
+    is one of 'ArgoUML', 'Poseidon' and 'UML2' if the exporting tool is
+    known, ``exporterText`` the content of ``XMI.exporter``.
+    """
+
+    def __init__(self, version=None, exporter=None, exporterText=None,
+                 namespaces=None):
+        self.version = version
+        self.exporter = exporter
+        self.exporterText = exporterText
+        self.namespaces = namespaces or {}
+
+    @property
+    def flavor(self):
+        from xmiparser.flavors import getFlavor
+        return getFlavor(self.version or '')
+
+    def __repr__(self):
+        return '<XMIHeader version=%s exporter=%s>' % (self.version,
+                                                       self.exporter)
+
+def sniffHeader(data):
+    """Return the ``XMIHeader`` of a document starting with data.
+    """
+    version = None
+    root = _root.search(data)
+    if root is not None:
+        attributes = dict([(m.group(1), m.group(3))
+                           for m in _attribute.finditer(root.group(2) or '')])
+        version = attributes.get('xmi.version', attributes.get('xmi:version'))
+    if version is None:
+        match = _version.search(data)
+        if match is not None:
+            version = match.group(2)
+    namespaces = dict([(m.group(1), m.group(3))
+                       for m in _namespace.finditer(data)])
+    exporterText = None
+    match = _exporter.search(data)
+    if match is not None:
+        exporterText = match.group(1).strip()
+    return XMIHeader(version, _detectExporter(exporterText, namespaces),
+                     exporterText, namespaces)
+
+def _detectExporter(text, namespaces):
+    text = text or ''
+    uris = namespaces.values()
+    if 'ArgoUML' in text:
+        return 'ArgoUML'
+    if 'Poseidon' in text or 'Gentleware' in text:
+        return 'Poseidon'
+    for uri in uris:
+        if 'eclipse.org/uml2' in uri:
+            return 'UML2'
+    # Poseidon keeps its UML 2 extensions in an own namespace
+    if 'org.omg.xmi.namespace.UML2' in uris:
+        return 'Poseidon'
+    return None
+
+def findDocument(zf):
+    """Return the name of the XMI document in a ``ZipFile``.
+    """
+    xmis = [n for n in zf.namelist() \
+            if os.path.splitext(n)[1].lower() in ('.xmi','.xml')]
+    if len(xmis) != 1:
+        raise ValueError("Archive contains %d *.xmi or *.xml files, expected "
+                         "one" % len(xmis))
+    return xmis[0]
+
+def sniff(source):
+    """Return the ``XMIHeader`` of source without parsing it.
+
+    source is anything ``ModelFactory`` accepts. Only the first bytes of the
+    document are read.
+    """
+    source = Source(source)
+    try:
+        if not source.isArchive:
+            return source.header()
+        zf = source.archive()
+        try:
+            member = PeekableFile(zf.open(findDocument(zf)))
+            return sniffHeader(member.peek(HEADER_SIZE))
+        finally:
+            zf.close()
+    finally:
+        source.close()
+
+class Source(object):
+    """Input of the model factory.
+
+    Accepts a path, the document as string or a file object. Compressed
+    input is detected from its content and decompressed while it is read.
+    """
+
+    path = None
+    compression = None
+
+    def __init__(self, source):
+        self.source = source
+        self._close = False
+        if isinstance(source, (buffer, bytearray)):
+            source = str(source)
+        elif isinstance(source, unicode) and isData(source):
+            source = encodeDocument(source)
+        if isinstance(source, basestring) and not isData(source):
+            self.path = self.name = source
+            fileobj = open(source, 'rb')
+            self._close = fileobj
+        elif isinstance(source, str):
+            self.name = '<string>'
+            fileobj = StringIO(source)
+        elif hasattr(source, 'read'):
+            self.name = getattr(source, 'name', '<stream>')
+            fileobj = source
+        else:
+            raise ValueError, "Can't read a model from %r" % source
+        fileobj = PeekableFile(fileobj)
+        head = fileobj.peek(len(XZ))
+        for magic, compression, factory in DECOMPRESSORS:
+            if head.startswith(magic):
+                log.debug("Reading %s compressed input.", compression)
+                self.compression = compression
+                fileobj = PeekableFile(DecompressingFile(fileobj, factory))
+                break
+        self.stream = fileobj
+
+    @property
+    def isArchive(self):
+        return self.stream.peek(len(ZIP)) == ZIP
+
+    def header(self):
+        """Return the ``XMIHeader`` of a plain document.
+        """
+        return sniffHeader(self.stream.peek(HEADER_SIZE))
+
+    def archive(self):
+        """Return the ``ZipFile`` of an archive.
+        """
+        if self.path is not None and self.compression is None:
+            return ZipFile(self.path)
+        # zip files need random access
+        return ZipFile(StringIO(self.stream.read()))
+
+    def close(self):
+        if self._close:
+            self._close.close()
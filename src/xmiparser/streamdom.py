@@ -0,0 +1,227 @@
+# Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
+# GNU General Public License Version 2 or later
+
+from xml.dom import Node
+from xml.parsers import expat
+
+def _escape(data):
+    # like minidom, so serialized documents compare equal
+    return data.replace('&', '&amp;').replace('<', '&lt;') \
+               .replace('"', '&quot;').replace('>', '&gt;')
+
+class Text(object):
+    """Text node.
+    """
+    __slots__ = ('data', 'parentNode')
+    nodeType = Node.TEXT_NODE
+    ELEMENT_NODE = Node.ELEMENT_NODE
+    TEXT_NODE = Node.TEXT_NODE
+    childNodes = ()
+    firstChild = None
+
+    def __init__(self, data, parentNode):
+        self.data = data
+        self.parentNode = parentNode
+
+    nodeValue = property(lambda self: self.data)
+
+    def _write(self, write):
+        write(_escape(self.data))
+
+class Comment(Text):
+    """Comment node, only kept if the filter asks for it.
+    """
+    __slots__ = ()
+    nodeType = Node.COMMENT_NODE
+
+    def _write(self, write):
+        write(u'<!--%s-->' % self.data)
+
+class Element(object):
+    """Element providing the part of the ``xml.dom`` API xmiparser uses.
+
+    Nodes have no instance dictionary, the attributes are kept as expat
+    reports them.
+    """
+    __slots__ = ('tagName', 'attributes', 'childNodes', 'parentNode',
+                 'ownerDocument', 'xmiElement', 'xmiChildIndex')
+    nodeType = Node.ELEMENT_NODE
+    ELEMENT_NODE = Node.ELEMENT_NODE
+    TEXT_NODE = Node.TEXT_NODE
+
+    def __init__(self, tagName, attributes, parentNode, ownerDocument):
+        self.tagName = tagName
+        self.attributes = attributes
+        self.childNodes = []
+        self.parentNode = parentNode
+        self.ownerDocument = ownerDocument
+
+    nodeName = property(lambda self: self.tagName)
+
+    @property
+    def firstChild(self):
+        if self.childNodes:
+            return self.childNodes[0]
+        return None
+
+    def getAttribute(self, name):
+        return self.attributes.get(name, u'')
+
+    def hasAttribute(self, name):
+        return name in self.attributes
+
+    def getElementsByTagName(self, tagName):
+        return [el for el in iterElements(self)
+                if tagName == '*' or el.tagName == tagName]
+
+    def toxml(self):
+        res = []
+        self._write(res.append)
+        return u''.join(res)
+
+    def _write(self, write):
+        write(u'<' + self.tagName)
+        attributes = self.attributes
+        for name in sorted(attributes.keys()):
+            write(u' %s="%s"' % (name, _escape(attributes[name])))
+        if not self.childNodes:
+            write(u'/>')
+            return
+        write(u'>')
+        for child in self.childNodes:
+            child._write(write)
+        write(u'</%s>' % self.tagName)
+
+class Document(object):
+    """Document node.
+    """
+    nodeType = Node.DOCUMENT_NODE
+    ELEMENT_NODE = Node.ELEMENT_NODE
+    TEXT_NODE = Node.TEXT_NODE
+    parentNode = None
+    documentElement = None
+
+    @property
+    def childNodes(self):
+        if self.documentElement is None:
+            return []
+        return [self.documentElement]
+
+    firstChild = property(lambda self: self.documentElement)
+
+    def iterElements(self):
+        root = self.documentElement
+        if root is None:
+            return iter(())
+        return iterElements(root, includeSelf=True)
+
+    def getElementsByTagName(self, tagName):
+        return [el for el in self.iterElements()
+                if tagName == '*' or el.tagName == tagName]
+
+def iterElements(node, includeSelf=False):
+    """Yield the elements below node in document order.
+    """
+    if includeSelf:
+        yield node
+    stack = [iter(node.childNodes)]
+    while stack:
+        for child in stack[-1]:
+            if child.nodeType == Node.ELEMENT_NODE:
+                yield child
+                stack.append(iter(child.childNodes))
+                break
+        else:
+            stack.pop()
+
+class Builder(object):
+    """Builds the document from expat events, dropping what the
+    ``ParseFilter`` filter asks for before a node is created.
+    """
+
+    def __init__(self, filter):
+        self.filter = filter
+        self.document = Document()
+        self.current = None
+        self.text = []
+        # depth within an ignored subtree
+        self.skip = 0
+        # ids of open elements with child elements
+        self.parents = set()
+
+    def parse(self, source):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.startElement
+        parser.EndElementHandler = self.endElement
+        parser.CharacterDataHandler = self.characters
+        if not self.filter.comments:
+            parser.CommentHandler = self.comment
+        if isinstance(source, basestring):
+            source = open(source, 'rb')
+            try:
+                parser.ParseFile(source)
+            finally:
+                source.close()
+        else:
+            parser.ParseFile(source)
+        return self.document
+
+    def characters(self, data):
+        if not self.skip:
+            self.text.append(data)
+
+    def flushText(self, ignorable):
+        data = u''.join(self.text)
+        self.text = []
+        node = self.current
+        if node is None or ignorable and self.filter.whitespace \
+           and not data.strip():
+            return
+        node.childNodes.append(Text(data, node))
+
+    def startElement(self, name, attributes):
+        if self.skip:
+            self.skip += 1
+            return
+        parent = self.current
+        if self.text:
+            # text before a child element
+            self.flushText(True)
+        if parent is not None:
+            self.parents.add(id(parent))
+            if name in self.filter.ignore:
+                self.skip = 1
+                return
+        if parent is None:
+            node = Element(name, attributes, self.document, self.document)
+            self.document.documentElement = node
+        else:
+            node = Element(name, attributes, parent, self.document)
+            parent.childNodes.append(node)
+        self.current = node
+
+    def endElement(self, name):
+        if self.skip:
+            self.skip -= 1
+            return
+        node = self.current
+        if self.text:
+            self.flushText(id(node) in self.parents)
+        self.parents.discard(id(node))
+        parent = node.parentNode
+        if parent is self.document:
+            parent = None
+        self.current = parent
+
+    def comment(self, data):
+        if self.skip or self.current is None:
+            return
+        if self.text:
+            self.flushText(True)
+        self.current.childNodes.append(Comment(data, self.current))
+
+def parse(source, filter):
+    """Parse source, dropping what the ``ParseFilter`` filter asks for.
+    """
+    return Builder(filter).parse(source)
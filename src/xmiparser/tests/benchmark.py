@@ -0,0 +1,458 @@
+# Copyright 2003-2009, BlueDynamics Alliance - http://bluedynamics.com
+# GNU General Public License Version 2 or later
+
+"""Benchmarks on synthetic models.
+
+Run all of them with ``python -m xmiparser.tests.benchmark`` or pass the
+names of the ones to run.
+"""
+
+import sys
+import time
+from cStringIO import StringIO
+
+def makeXMI(packages=20, classes=50, attributes=10, indent=True,
+            name='model'):
+    """Return a XMI 1.2 document as exported by Poseidon.
+
+    Each class gets a stereotype, tagged values, attributes with multiplicity
+    and a generalization to the previous class of its package. A diagram
+    interchange block with geometry for every class is appended, too.
+    """
+    nl = indent and '\n' or ''
+    out = []
+    w = out.append
+    w("<?xml version='1.0' encoding='UTF-8'?>%s" % nl)
+    w("<XMI xmi.version='1.2' xmlns:UML='org.omg.xmi.namespace.UML'>%s" % nl)
+    w("  <XMI.header><XMI.documentation>"
+      "<XMI.exporter>Gentleware</XMI.exporter>"
+      "</XMI.documentation></XMI.header>%s" % nl)
+    w("  <XMI.content>%s" % nl)
+    w("    <UML:Model xmi.id='model' name='%s'>%s" % (name, nl))
+    w("      <UML:Namespace.ownedElement>%s" % nl)
+    w("        <UML:Stereotype xmi.id='st' name='content'/>%s" % nl)
+    w("        <UML:TagDefinition xmi.id='td' name='module'/>%s" % nl)
+    w("        <UML:DataType xmi.id='dt' name='string'/>%s" % nl)
+    for p in range(packages):
+        w("        <UML:Package xmi.id='p%d' name='package%d'>%s" % (p, p, nl))
+        w("          <UML:Namespace.ownedElement>%s" % nl)
+        for c in range(classes):
+            cid = 'p%dc%d' % (p, c)
+            w("            <UML:Class xmi.id='%s' name='Class%d'>%s" % \
+              (cid, c, nl))
+            w("              <UML:ModelElement.stereotype>"
+              "<UML:Stereotype xmi.idref='st'/>"
+              "</UML:ModelElement.stereotype>%s" % nl)
+            w("              <UML:ModelElement.taggedValue>%s" % nl)
+            w("                <UML:TaggedValue xmi.id='%st'>"
+              "<UML:TaggedValue.dataValue>module%d</UML:TaggedValue.dataValue>"
+              "<UML:TaggedValue.type><UML:TagDefinition xmi.idref='td'/>"
+              "</UML:TaggedValue.type></UML:TaggedValue>%s" % (cid, c, nl))
+            w("              </UML:ModelElement.taggedValue>%s" % nl)
+            w("              <UML:Classifier.feature>%s" % nl)
+            for a in range(attributes):
+                w("                <UML:Attribute xmi.id='%sa%d' name='attr%d'"
+                  " visibility='public'>%s" % (cid, a, a, nl))
+                w("                  <UML:StructuralFeature.multiplicity>"
+                  "<UML:Multiplicity><UML:Multiplicity.range>"
+                  "<UML:MultiplicityRange lower='0' upper='1'/>"
+                  "</UML:Multiplicity.range></UML:Multiplicity>"
+                  "</UML:StructuralFeature.multiplicity>%s" % nl)
+                w("                  <UML:StructuralFeature.type>"
+                  "<UML:DataType xmi.idref='dt'/>"
+                  "</UML:StructuralFeature.type>%s" % nl)
+                w("                </UML:Attribute>%s" % nl)
+            w("              </UML:Classifier.feature>%s" % nl)
+            w("            </UML:Class>%s" % nl)
+            if c:
+                w("            <UML:Generalization xmi.id='%sg'>"
+                  "<UML:Generalization.child><UML:Class xmi.idref='%s'/>"
+                  "</UML:Generalization.child><UML:Generalization.parent>"
+                  "<UML:Class xmi.idref='p%dc%d'/>"
+                  "</UML:Generalization.parent></UML:Generalization>%s" % \
+                  (cid, cid, p, c - 1, nl))
+        w("          </UML:Namespace.ownedElement>%s" % nl)
+        w("        </UML:Package>%s" % nl)
+    w("      </UML:Namespace.ownedElement>%s" % nl)
+    w("    </UML:Model>%s" % nl)
+    w("    <UML:Diagram xmi.id='diagram' name='main'>%s" % nl)
+    w("      <UML:GraphElement.contained>%s" % nl)
+    for p in range(packages):
+        for c in range(classes):
+            w("        <UML:GraphNode xmi.id='gn%d_%d'>"
+              "<UML:GraphElement.position><XMI.field>%d</XMI.field>"
+              "<XMI.field>%d</XMI.field></UML:GraphElement.position>"
+              "<UML:GraphNode.size><XMI.field>120</XMI.field>"
+              "<XMI.field>80</XMI.field></UML:GraphNode.size>"
+              "<UML:GraphElement.semanticModel>"
+              "<UML:Uml1SemanticModelBridge><UML:Uml1SemanticModelBridge.element>"
+              "<UML:Class xmi.idref='p%dc%d'/>"
+              "</UML:Uml1SemanticModelBridge.element>"
+              "</UML:Uml1SemanticModelBridge></UML:GraphElement.semanticModel>"
+              "</UML:GraphNode>%s" % (p, c, p * 10, c * 10, p, c, nl))
+    w("      </UML:GraphElement.contained>%s" % nl)
+    w("    </UML:Diagram>%s" % nl)
+    w("  </XMI.content>%s" % nl)
+    w("  <XMI.extension xmi.extender='Gentleware'>%s" % nl)
+    for i in range(packages * classes):
+        w("    <layout element='p%dc%d' x='%d' y='%d'/>%s" % \
+          (i // classes, i % classes, i, i, nl))
+    w("  </XMI.extension>%s" % nl)
+    w("</XMI>%s" % nl)
+    return ''.join(out)
+
+def timed(func, *args, **kw):
+    """Return the best wall time of three runs of func and its last result.
+    """
+    best = None
+    for i in range(3):
+        start = time.time()
+        res = func(*args, **kw)
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    return best, res
+
+def report(title, rows):
+    print
+    print title
+    print '=' * len(title)
+    for row in rows:
+        print '%-40s %s' % row
+
+def queryModel(doc, XMI):
+    """Run the lookups a model build does for every package, class and
+    attribute.
+    """
+    from xmiparser.xmiutils import getElementByTagName
+    from xmiparser.xmiutils import getElementsByTagName
+    count = 0
+    model = getElementsByTagName(doc, XMI.MODEL, recursive=1)[0]
+    owned = getElementByTagName(model, XMI.OWNED_ELEMENT)
+    for package in getElementsByTagName(owned, XMI.PACKAGE):
+        powned = getElementByTagName(package, XMI.OWNED_ELEMENT)
+        for klass in getElementsByTagName(powned, XMI.CLASS):
+            getElementsByTagName(klass, XMI.STEREOTYPE_MODELELEMENT)
+            tgvsm = getElementByTagName(klass, XMI.TAGGED_VALUE_MODEL)
+            getElementsByTagName(tgvsm, XMI.TAGGED_VALUE)
+            for attr in getElementsByTagName(klass, XMI.ATTRIBUTE,
+                                             recursive=1):
+                getElementByTagName(attr, XMI.MULTRANGE, recursive=1)
+                getElementsByTagName(attr, XMI.TYPE, recursive=1)
+                count += 1
+    return count
+
+def benchEngines(packages=20, classes=50, attributes=10):
+    """Parse and query a synthetic model with the minidom and lxml engines.
+    """
+    from xmiparser.backends import getBackend
+    from xmiparser.flavors.xmi1_2 import XMI1_2
+    xmi = makeXMI(packages, classes, attributes)
+    rows = [('document size', '%d KB' % (len(xmi) // 1024))]
+    for name in ('minidom', 'lxml'):
+        backend = getBackend(name)
+        parsetime, doc = timed(lambda: backend.parse(StringIO(xmi)))
+        querytime, count = timed(queryModel, doc, XMI1_2())
+        rows.append(('%s (%s) parse' % (name, backend.__class__.__name__),
+                     '%.3fs' % parsetime))
+        rows.append(('%s query %d attributes' % (name, count),
+                     '%.3fs' % querytime))
+    report('Parser engines', rows)
+
+def reduceWrap(text, width):
+    """The quadratic word wrap utils.wrap replaced, for comparison.
+    """
+    return reduce(lambda line, word, width=width: '%s%s%s' %
+                  (line,
+                   ' \n'[(len(line[line.rfind('\n')+1:])
+                         + len(word.split('\n',1)[0]
+                              ) >= width)],
+                   word),
+                  text.split(' ')
+                 )
+
+def makeDocumentation(size=8192):
+    """Return a note of about size bytes as modellers paste them.
+    """
+    paragraph = ('The customer places an order for one or more items. '
+                 'Each item references a product of the catalog and keeps '
+                 'the price valid at the time of ordering, see '
+                 'http://example.com/glossary/order-item for details.\n'
+                 '  - Orders are never deleted, only cancelled.\n\n')
+    return (paragraph * (size // len(paragraph) + 1))[:size]
+
+def benchWrap(sizes=(2048, 8192, 32768), width=64):
+    """Wrap documentation blocks with utils.wrap and the old reduce recipe.
+    """
+    from xmiparser.utils import wrap
+    rows = []
+    for size in sizes:
+        doc = makeDocumentation(size)
+        reducetime, expected = timed(reduceWrap, doc, width)
+        wraptime, res = timed(wrap, doc, width)
+        assert res == expected
+        out = StringIO()
+        buffertime, res = timed(wrap, doc, width, out)
+        rows.append(('%d KB reduce' % (size // 1024),
+                     '%.5fs' % reducetime))
+        rows.append(('%d KB wrap' % (size // 1024), '%.5fs' % wraptime))
+        rows.append(('%d KB wrap to buffer' % (size // 1024),
+                     '%.5fs' % buffertime))
+    report('Word wrap', rows)
+
+def walkFlavor(element):
+    """Look up the flavor through the parents, as ``XMIElement.XMI`` did for
+    every read before elements were bound to it.
+    """
+    from zope.location import LocationIterator
+    for parent in LocationIterator(element):
+        if parent.__XMI__ is not None:
+            return parent.__XMI__
+
+def benchFlavor(depths=(1, 10, 100), reads=100000):
+    """Read the flavor of an element nested depth packages below the model.
+    """
+    from xmiparser.xmielements import XMIElement
+    from xmiparser.xmielements import XMIRegistry
+    from xmiparser.flavors.xmi1_2 import XMI1_2
+    def read(element):
+        for i in xrange(reads):
+            element.XMI
+    def walk(element):
+        for i in xrange(reads):
+            walkFlavor(element)
+    rows = []
+    for depth in depths:
+        model = element = unbound = XMIElement('model', None)
+        model.registry = XMIRegistry()
+        model.__XMI__ = XMI1_2()
+        for i in range(depth):
+            child = XMIElement('package%d' % i, None)
+            child.initialize(element)
+            element = child
+            # the same tree without flavors bound
+            child = XMIElement('package%d' % i, None)
+            child.__parent__ = unbound
+            unbound = child
+        walktime, res = timed(walk, unbound)
+        boundtime, res = timed(read, element)
+        rows.append(('depth %d, %d reads, walk' % (depth, reads),
+                     '%.4fs' % walktime))
+        rows.append(('depth %d, %d reads, bound' % (depth, reads),
+                     '%.4fs' % boundtime))
+    report('Flavor access', rows)
+
+def makeTaggedElements(elements=2000, tags=10, lines=3):
+    """Return a document of elements with multiline tagged values.
+    """
+    from xml.dom import minidom
+    out = ['<XMI xmlns:UML="org.omg.xmi.namespace.UML">']
+    w = out.append
+    for i in range(elements):
+        w('<UML:Class xmi.id="c%d" name="Class%d">' % (i, i))
+        w('<UML:ModelElement.taggedValue>')
+        for j in range(tags):
+            for k in range(lines):
+                w('<UML:TaggedValue xmi.id="c%d-t%d-%d">' % (i, j, k))
+                w('<UML:TaggedValue.tag>tag%d</UML:TaggedValue.tag>' % j)
+                w('<UML:TaggedValue.value>line %d</UML:TaggedValue.value>' % k)
+                w('</UML:TaggedValue>')
+        w('</UML:ModelElement.taggedValue>')
+        w('</UML:Class>')
+    w('</XMI>')
+    return minidom.parseString(''.join(out))
+
+def benchTaggedValues(elements=2000, tags=10, lines=3):
+    """Build elements with and without reading their tagged values.
+    """
+    from xmiparser.xmielements import XMIElement
+    from xmiparser.xmielements import XMIRegistry
+    from xmiparser.xmiutils import TagIndex
+    from xmiparser.flavors.xmi1_1 import XMI1_1
+    doc = makeTaggedElements(elements, tags, lines)
+    doms = [n for n in doc.documentElement.childNodes
+            if n.nodeType == n.ELEMENT_NODE]
+    def build(read):
+        model = XMIElement('model', None)
+        model.registry = XMIRegistry()
+        model.__XMI__ = XMI1_1(index=TagIndex(doc))
+        for dom in doms:
+            element = XMIElement(None, dom)
+            element.initialize(model)
+            if read:
+                element.tgvs
+        return model
+    rows = []
+    for read, title in ((False, 'build'), (True, 'build and read tgvs')):
+        took, res = timed(build, read)
+        rows.append(('%d elements, %s' % (elements, title), '%.4fs' % took))
+    report('Tagged values', rows)
+
+def inFreshProcess(name, *args):
+    """Call the function name of this module with args in a new interpreter
+    and return its result.
+
+    Peak resident sizes measured there start from a small heap, not from the
+    one grown by earlier benchmarks. Arguments and result are pickled.
+    """
+    import os
+    import cPickle
+    import subprocess
+    import xmiparser
+    script = ('import sys, cPickle\n'
+              'from xmiparser.tests import benchmark\n'
+              'out, sys.stdout = sys.stdout, sys.stderr\n'
+              'args = cPickle.load(sys.stdin)\n'
+              'out.write(cPickle.dumps(benchmark.%s(*args), 2))\n' % name)
+    env = dict(os.environ)
+    path = [os.path.dirname(os.path.dirname(os.path.abspath(
+        xmiparser.__file__)))]
+    if env.get('PYTHONPATH'):
+        path.append(env['PYTHONPATH'])
+    env['PYTHONPATH'] = os.pathsep.join(path)
+    process = subprocess.Popen([sys.executable, '-c', script], env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    out = process.communicate(cPickle.dumps(args, 2))[0]
+    if process.returncode:
+        raise RuntimeError('%s failed with exit code %d' % (
+            name, process.returncode))
+    return cPickle.loads(out)
+
+def peakMemory():
+    """Return the peak resident size of this process in KB.
+
+    Linux keeps ru_maxrss across exec, a new interpreter would start from the
+    peak of the process starting it. VmHWM belongs to the process itself.
+    """
+    import resource
+    try:
+        f = open('/proc/self/status')
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        for line in f:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    finally:
+        f.close()
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def measureBuild(source, backend, filter):
+    """Build a model, return time, growth of the peak resident size in KB and
+    the number of DOM nodes. Meant to run in a fresh process.
+    """
+    from xmiparser.factory import ModelFactory
+    factory = ModelFactory(backend=backend, filter=filter)
+    before = peakMemory()
+    start = time.time()
+    model = factory(source)
+    took = time.time() - start
+    after = peakMemory()
+    nodes = 0
+    stack = [model.document]
+    while stack:
+        node = stack.pop()
+        nodes += 1
+        stack.extend(node.childNodes)
+    return took, after - before, nodes
+
+def measureParse(backend, packages, classes, attributes):
+    """Parse a synthetic document, return the time and the growth of the
+    peak resident size in KB. Meant to run in a fresh process.
+    """
+    from StringIO import StringIO
+    from xmiparser.backends import getBackend
+    source = StringIO(makeXMI(packages, classes, attributes))
+    before = peakMemory()
+    start = time.time()
+    document = getBackend(backend).parse(source)
+    took = time.time() - start
+    return took, peakMemory() - before
+
+def _backends():
+    from xmiparser.backends import lxmldom
+    if lxmldom is None:
+        return ('minidom', 'streaming')
+    return ('minidom', 'streaming', 'lxml')
+
+def benchMemory(packages=20, classes=50, attributes=10):
+    """Parse a synthetic document with every backend, each in a fresh
+    process.
+    """
+    rows = [('document size', '%d KB' % (len(makeXMI(packages, classes,
+                                                     attributes)) // 1024))]
+    for backend in _backends():
+        took, memory = inFreshProcess('measureParse', backend, packages,
+                                      classes, attributes)
+        rows.append((backend, '%.3fs %6d KB' % (took, memory)))
+    report('Parse memory', rows)
+
+def benchFilter(packages=20, classes=50, attributes=10):
+    """Build models with and without the parse filter.
+
+    Uses a synthetic Poseidon export with diagram geometry and the exports
+    shipped with the tests.
+    """
+    import os
+    from xmiparser.backends import ParseFilter
+    datadir = os.path.join(os.path.dirname(__file__), 'data')
+    sources = [('synthetic', makeXMI(packages, classes, attributes))]
+    for name in sorted(os.listdir(datadir)):
+        sources.append((name, os.path.join(datadir, name)))
+    rows = []
+    for name, source in sources:
+        for backend in _backends():
+            for filter in (None, ParseFilter()):
+                # memory is the growth of the peak resident size
+                took, memory, nodes = inFreshProcess('measureBuild', source,
+                                                     backend, filter)
+                rows.append(('%s %s%s' % (name, backend,
+                                          filter and ' filtered' or ''),
+                             '%.3fs %6d KB %7d nodes' % (took, memory,
+                                                         nodes)))
+    report('Parse filter', rows)
+    if 'lxml' in _backends():
+        print
+        print ('lxml parses the whole document and prunes the ignored '
+               'subtrees afterwards,')
+        print 'its peak memory includes them.'
+
+def benchLazy(packages=50, classes=100):
+    """Build one package of a model parsed once, and all of them.
+    """
+    from xmiparser.backends import getBackend
+    from xmiparser.xmiutils import TagIndex
+    from xmiparser.xmielements import XMIModel
+    from xmiparser.flavors.xmi1_2 import XMI1_2
+    # without attributes, their datatypes are collected by the full build
+    doc = getBackend('minidom').parse(StringIO(makeXMI(packages, classes, 0)))
+    index = TagIndex(doc)
+    def build(all):
+        model = XMIModel('model', doc, XMI1_2(index=index), lazy=True)
+        if all:
+            model.load()
+        else:
+            model.getPackages()[packages // 2].getClasses()
+        return len(model.registry)
+    rows = []
+    for all, title in ((False, 'one package'), (True, 'all packages')):
+        took, count = timed(build, all)
+        rows.append(('%s, %d elements' % (title, count), '%.3fs' % took))
+    report('Lazy packages', rows)
+
+BENCHMARKS = {
+    'engines': benchEngines,
+    'filter': benchFilter,
+    'flavor': benchFlavor,
+    'lazy': benchLazy,
+    'memory': benchMemory,
+    'taggedvalues': benchTaggedValues,
+    'wrap': benchWrap,
+}
+
+def main(names):
+    for name in names or sorted(BENCHMARKS.keys()):
+        BENCHMARKS[name]()
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
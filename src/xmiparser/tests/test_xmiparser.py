@@ -16,10 +16,22 @@ optionflags = doctest.NORMALIZE_WHITESPACE | \
               doctest.REPORT_ONLY_FIRST_FAILURE
 
 TESTFILES = [
+    '../backends.txt',
+    '../batch.txt',
+    '../cache.txt',
     '../factory.txt',
+    '../flavors/xmi1_0.txt',
+    '../utils.txt',
+    '../xmiutils.txt',
     '../xmielements.txt',
 ]
 
+try:
+    import lxml
+    TESTFILES.append('../lxmldom.txt')
+except ImportError:
+    pass
+
 datadir = os.path.join(os.path.dirname(__file__), 'data') 
 
 def test_suite():
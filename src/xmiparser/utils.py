@@ -6,7 +6,6 @@
 import logging
 import string
 import types
-import logging
 log = logging.getLogger('utils')
 
 specialrpl = {
@@ -36,53 +35,108 @@ def toBoolean(v):
         return True
     return False
 
+# single characters to their replacement, for unicode.translate
+special_trans = dict([(ord(key), value) for key, value in specialrpl.items()])
+
+# first characters int() or float() may accept, after sign and whitespace
+_numberStart = frozenset('0123456789.iInN')
+
+# results of normalize, names and tags repeat a lot. Longer strings, like
+# documentation, rarely do and are not kept alive.
+_normalized = {}
+NORMALIZE_CACHE_SIZE = 4096
+NORMALIZE_CACHE_LENGTH = 64
+
 def normalize(data, doReplace=False):
     """Converts a unicode to string, stripping blank spaces."""
-    log.debug("Normalizing %r.", data)
     if type(data) not in types.StringTypes:
-        log.debug("Not string, returning as-is.")
         return data
+    if len(data) > NORMALIZE_CACHE_LENGTH:
+        return _normalize(data, doReplace)
+    key = (type(data), data, doReplace)
     try:
-        data = int(data)
-        log.debug("Converted to integer, returning %r.",
-                  data)
-        return data
-    except ValueError:
-        pass
-    try:
-        data = float(data)
-        log.debug("Converted to float, returning %r.",
-                  data)
-        return data
-    except ValueError:
+        return _normalized[key]
+    except KeyError:
         pass
+    res = _normalize(data, doReplace)
+    if len(_normalized) >= NORMALIZE_CACHE_SIZE:
+        _normalized.clear()
+    _normalized[key] = res
+    return res
+
+def _couldBeNumber(data):
+    data = data.strip()
+    if data[:1] in ('+', '-'):
+        # int() allows blanks after the sign
+        data = data[1:].lstrip()
+    start = data[:1]
+    return start in _numberStart or start.isdigit()
+
+def _normalize(data, doReplace):
+    debug = log.isEnabledFor(logging.DEBUG)
+    if debug:
+        log.debug("Normalizing %r.", data)
+    if _couldBeNumber(data):
+        try:
+            data = int(data)
+            if debug:
+                log.debug("Converted to integer, returning %r.", data)
+            return data
+        except ValueError:
+            pass
+        try:
+            data = float(data)
+            if debug:
+                log.debug("Converted to float, returning %r.", data)
+            return data
+        except ValueError:
+            pass
     if type(data) is types.StringType:
         # make unicode
         data = data.decode('utf-8')
-    if type(data) is types.UnicodeType:
-        data = data.strip()
-        if doReplace:
-            for key in specialrpl:
-                data = data.replace(key, specialrpl[key])    
-    if not data is None:
+    data = data.strip()
+    if doReplace:
+        data = data.translate(special_trans)
+    if debug:
         log.debug("Normalized, returning %r.", data)
-        return data.encode('utf-8')
-    else:
-        return None
+    return data.encode('utf-8')
 
+# line break semantics of
 # http://aspn.activestate.com/ASPN/Cookbook/Python/Recipe/148061
-def wrap(text, width):
+def wrap(text, width, out=None):
     """
     A word-wrap function that preserves existing line breaks
     and most spaces in the text. Expects that existing line
     breaks are posix newlines (\n).
-    """
-    return reduce(lambda line, word, width=width: '%s%s%s' %
-                  (line,
-                   ' \n'[(len(line[line.rfind('\n')+1:])
-                         + len(word.split('\n',1)[0]
-                              ) >= width)],
-                   word),
-                  text.split(' ')
-                 )
 
+    Runs in linear time. With out, a file like object, the wrapped text is
+    written to it and None is returned.
+    """
+    words = text.split(' ')
+    if out is None:
+        res = []
+        write = res.append
+    else:
+        write = out.write
+    word = words[0]
+    write(word)
+    # length of the current, last line written
+    length = len(word) - word.rfind('\n') - 1
+    for word in words[1:]:
+        first = word.find('\n')
+        if first < 0:
+            first = len(word)
+        if length + first >= width:
+            write('\n')
+            length = 0
+        else:
+            write(' ')
+            length += 1
+        write(word)
+        last = word.rfind('\n')
+        if last < 0:
+            length += len(word)
+        else:
+            length = len(word) - last - 1
+    if out is None:
+        return ''.join(res)
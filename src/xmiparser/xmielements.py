@@ -3,6 +3,8 @@
 
 import os.path
 import logging
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from sets import Set
 from odict import odict
 from zodict.node import Node
@@ -14,6 +16,9 @@ from xmiparser.utils import toBoolean
 from xmiparser.utils import normalize
 from xmiparser.utils import wrap as doWrap
 from xmiparser.utils import clean_trans
+from xmiparser.xmiutils import getSubElement
+from xmiparser.xmiutils import getSubElements
+from xmiparser.xmiutils import getAttributeValue
 from xmiparser.xmiutils import getElementByTagName
 from xmiparser.xmiutils import getElementsByTagName
 from xmiparser.interfaces import IXMIStateMachineContainer
@@ -40,8 +45,199 @@ from xmiparser.interfaces import IXMIDiagram
     
 log = logging.getLogger('XMIparser')
 
-allObjects = {} # XXX: i dont like this concept of a global dict (jensens)
-                #      me neither (rnix))
+_marker = object()
+
+class XMIRegistry(object):
+    """Identity map of the elements of one model.
+
+    Maps XMI ids to elements and elements back to their XMI ids. Each
+    ``XMIModel`` holds its own registry, it goes away together with the model.
+
+    Registered elements are indexed by stereotype, tag and tagged value.
+
+    Ids of elements not built yet are passed to ``resolver`` if one is set,
+    it builds and returns the element or returns None.
+    """
+
+    resolver = None
+
+    def __init__(self):
+        self.elements = {}
+        # elements are not hashable, they are keyed by identity. The registry
+        # references them, so identities stay unique.
+        self.ids = {}
+        self.stereotypes = {}
+        self.tags = {}
+        self.taggedValues = {}
+        self.names = {}
+        # bumped whenever a generalization is added
+        self.generalizations = 0
+        # bumped whenever an association is attached to a class
+        self.associations = 0
+        # what each element was indexed with, to unindex it
+        self.indexed = {}
+        # elements with tagged values not parsed yet, indexed on first query
+        self.pending = {}
+        self.sequence = 0
+
+    def register(self, element, xmiid):
+        if not xmiid:
+            # elements without id are indexed, but not found by id
+            return
+        old = self.elements.get(xmiid)
+        if old is not None:
+            del self.ids[id(old)]
+            self.unindex(old)
+        self.elements[xmiid] = element
+        self.ids[id(element)] = xmiid
+
+    def index(self, element):
+        """Index element by its current stereotypes, tagged values and
+        qualified name.
+        """
+        self.unindex(element)
+        stereotypes = list(element.stereotypes)
+        for name in stereotypes:
+            self.stereotypes.setdefault(name, []).append(element)
+        if element._tgvsPending:
+            # don't parse the tagged values before they are asked for
+            tgvs = None
+            self.sequence += 1
+            self.pending[id(element)] = (self.sequence, element)
+        else:
+            tgvs = element.tgvs.items()
+            self._indexTaggedValues(element, tgvs)
+        qualifiedName = None
+        if _isNamed(element):
+            element._qualifiedName = None
+            qualifiedName = element.qualifiedName
+            # the first one wins, like for overloaded operations
+            self.names.setdefault(qualifiedName, element)
+        self.indexed[id(element)] = (stereotypes, tgvs, qualifiedName)
+
+    def unindex(self, element):
+        try:
+            stereotypes, tgvs, qualifiedName = self.indexed.pop(id(element))
+        except KeyError:
+            return
+        for name in stereotypes:
+            self._remove(self.stereotypes, name, element)
+        if tgvs is None:
+            del self.pending[id(element)]
+            tgvs = ()
+        for tag, value in tgvs:
+            self._remove(self.tags, tag, element)
+            self._remove(self.taggedValues, (tag, value), element)
+        if self.names.get(qualifiedName) is element:
+            del self.names[qualifiedName]
+
+    def _indexTaggedValues(self, element, tgvs):
+        for tag, value in tgvs:
+            self.tags.setdefault(tag, []).append(element)
+            self.taggedValues.setdefault((tag, value), []).append(element)
+
+    def indexTaggedValues(self):
+        """Parse and index the tagged values of elements still pending.
+        """
+        if not self.pending:
+            return
+        pending = self.pending.values()
+        pending.sort()
+        self.pending = {}
+        for sequence, element in pending:
+            tgvs = element.tgvs.items()
+            self._indexTaggedValues(element, tgvs)
+            stereotypes, old, qualifiedName = self.indexed[id(element)]
+            self.indexed[id(element)] = (stereotypes, tgvs, qualifiedName)
+
+    def _remove(self, mapping, key, element):
+        elements = mapping[key]
+        for i in range(len(elements)):
+            if elements[i] is element:
+                del elements[i]
+                break
+        if not elements:
+            del mapping[key]
+
+    def getId(self, element, default=None):
+        return self.ids.get(id(element), default)
+
+    def get(self, xmiid, default=None):
+        try:
+            return self[xmiid]
+        except KeyError:
+            return default
+
+    def __getitem__(self, xmiid):
+        try:
+            return self.elements[xmiid]
+        except KeyError:
+            if self.resolver is None:
+                raise
+        element = self.resolver(xmiid)
+        if element is None:
+            raise KeyError(xmiid)
+        return element
+
+    def __contains__(self, xmiid):
+        return self.get(xmiid) is not None
+
+    has_key = __contains__
+
+    def __len__(self):
+        return len(self.elements)
+
+    def __iter__(self):
+        return iter(self.elements)
+
+    def values(self):
+        return self.elements.values()
+
+    def __getstate__(self):
+        self.indexTaggedValues()
+        # identities don't survive pickling, the reverse maps are rebuilt
+        return {'elements': self.elements,
+                'stereotypes': self.stereotypes,
+                'taggedValues': self.taggedValues,
+                'names': self.names,
+                'generalizations': self.generalizations,
+                'associations': self.associations}
+
+    def __setstate__(self, state):
+        self.elements = state['elements']
+        self.ids = dict([(id(e), xmiid) for xmiid, e in self.elements.items()])
+        self.stereotypes = state['stereotypes']
+        self.taggedValues = state['taggedValues']
+        self.names = state['names']
+        self.generalizations = state['generalizations']
+        self.associations = state['associations']
+        # elements may not be restored yet, rebuild from the index only
+        self.tags = {}
+        self.indexed = {}
+        self.pending = {}
+        self.sequence = 0
+        def indexed(element):
+            return self.indexed.setdefault(id(element), [[], [], None])
+        for name, elements in self.stereotypes.items():
+            for element in elements:
+                indexed(element)[0].append(name)
+        for (tag, value), elements in self.taggedValues.items():
+            for element in elements:
+                self.tags.setdefault(tag, []).append(element)
+                indexed(element)[1].append((tag, value))
+        for qualifiedName, element in self.names.items():
+            indexed(element)[2] = qualifiedName
+
+def _newElement(cls):
+    return cls.__new__(cls)
+
+def _isNamed(element):
+    """Whether element is found by its qualified name.
+    """
+    for iface in (IXMIPackage, IXMIClass, IXMIAttribute, IXMIMethod):
+        if iface.providedBy(element):
+            return not IXMIModel.providedBy(element)
+    return False
 
 class PseudoElement(object):
     """Need to pretend a class - why?
@@ -55,103 +251,283 @@ class PseudoElement(object):
     def getModuleName(self):
         return self.xminame
 
+class _Unallocated(object):
+    """Empty container standing in for an attribute not written yet.
+
+    Reads answer like an empty container, the first write allocates the
+    real one on the instance. Once allocated, reads and writes go to the
+    real container, a stand-in held from before never goes stale.
+    """
+    __slots__ = ('instance', 'name', 'factory')
+
+    # methods writing to lists and odicts
+    mutators = frozenset(['append', 'extend', 'insert', 'remove', 'pop',
+                          'reverse', 'sort', 'update', 'setdefault',
+                          'popitem', 'clear'])
+
+    def __init__(self, instance, name, factory):
+        self.instance = instance
+        self.name = name
+        self.factory = factory
+
+    def allocate(self):
+        value = self.instance.__dict__.get(self.name)
+        if value is None:
+            value = self.instance.__dict__[self.name] = self.factory()
+        return value
+
+    def current(self):
+        """Return the real container if allocated, else an empty one.
+        """
+        value = self.instance.__dict__.get(self.name)
+        if value is None:
+            return self.factory()
+        return value
+
+    # isinstance checks see the type of the real container
+    __class__ = property(lambda self: self.factory)
+
+    def __getattr__(self, name):
+        if name in self.mutators:
+            return getattr(self.allocate(), name)
+        return getattr(self.current(), name)
+
+    def __len__(self):
+        return len(self.current())
+
+    def __nonzero__(self):
+        return bool(self.current())
+
+    def __iter__(self):
+        return iter(self.current())
+
+    def __contains__(self, item):
+        return item in self.current()
+
+    def __getitem__(self, key):
+        return self.current()[key]
+
+    def __setitem__(self, key, value):
+        self.allocate()[key] = value
+
+    def __delitem__(self, key):
+        del self.allocate()[key]
+
+    def __iadd__(self, other):
+        value = self.allocate()
+        value += other
+        return value
+
+    def __add__(self, other):
+        return self.current() + other
+
+    def __radd__(self, other):
+        return other + self.current()
+
+    def __eq__(self, other):
+        return self.current() == other
+
+    def __ne__(self, other):
+        return self.current() != other
+
+    def __repr__(self):
+        return repr(self.current())
+
+class allocateOnWrite(object):
+    """Container attribute allocated on the instance when first written.
+
+    Most elements have no tagged values, subtypes or dependencies, they share
+    one class attribute instead of an empty list or odict each.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+
+    def __get__(self, instance, cls):
+        if instance is None:
+            return self
+        # once written the instance attribute shadows this descriptor
+        return _Unallocated(instance, self.name, self.factory)
+
+class parseOnRead(allocateOnWrite):
+    """``tgvs`` parsed from the DOM when first read.
+    """
+
+    def __get__(self, instance, cls):
+        if instance is not None and instance._tgvsPending:
+            instance._parseTaggedValues()
+            if self.name in instance.__dict__:
+                return instance.__dict__[self.name]
+        return allocateOnWrite.__get__(self, instance, cls)
+
 class XMIElement(Node):
     implements(IXMIElement)
     
     __XMI__ = None
-        
+    registry = None
+
+    # defaults shared by all elements until an element sets its own
+    id = ''
+    cleanName = ''
+    maxOccurs = 1
+    isComplex = False
+    type = 'NoneType' # phew !?
+    subTypes = allocateOnWrite('subTypes', list) # double phew !?
+    attributeDefs = allocateOnWrite('attributeDefs', list)
+    operationDefs = allocateOnWrite('operationDefs', list)
+    tgvs = parseOnRead('tgvs', odict)
+    # whether tgvs still need to be parsed from the DOM
+    _tgvsPending = False
+    stereotypes = allocateOnWrite('stereotypes', list)
+    clientDependencies = allocateOnWrite('clientDependencies', list)
+
     def __init__(self, name, dom, *args, **kwargs):
         Node.__init__(self, name)
         self.domElement = dom
-        self.id = ''
-        self.cleanName = ''
-        self.maxOccurs = 1
-        self.isComplex = False
-        self.type = 'NoneType' # phew !?
-        self.subTypes = [] # double phew !?
-        self.attributeDefs = []
-        self.operationDefs = []
-        self.tgvs = odict()
-        self.stereotypes = []
-        self.clientDependencies = []
         
         # Take kwargs as attributes
         # XXX: this looks dangerous in the complex context of XMI elements and
         #      their class hirarchy (rnix)
         self.__dict__.update(kwargs)
     
-    #def __setitem__(self, key, val):
-    #    val.__name__ = key
-    #    val.__parent__ = self
-    #    zodict.__setitem__(self, key, val)
+    def __setitem__(self, key, val):
+        Node.__setitem__(self, key, val)
+        if isinstance(val, XMIElement):
+            val.bind(self)
     
     def initialize(self, parent):
         """Workaround function.
         """
         self.__parent__ = parent
-        if self.domElement:
-            allObjects[dom.getAttribute('xmi.id')] = self
+        if parent is not None:
+            self.bind(parent)
+        if self.domElement is not None:
+            self.registry.register(self,
+                                   str(self.domElement.getAttribute('xmi.id')))
             self._initFromDOM()
+            self.registry.index(self)
     
     __repr__ = object.__repr__
-    
+
+    # attributes referring to the DOM, not part of snapshots
+    domAttributes = ('domElement',)
+    # bookkeeping of the node, rebuilt when unpickled
+    nodeAttributes = ('_lh', '_lt', '_index', '_uuid')
+
+    def __reduce__(self):
+        # Pickling a node as dict would set its children before its state.
+        # Children go with the state instead.
+        if self._tgvsPending:
+            self._parseTaggedValues()
+        skip = self.domAttributes + self.nodeAttributes
+        state = dict([(k, v) for k, v in self.__dict__.items()
+                       if k not in skip])
+        state['__children__'] = self.items()
+        return _newElement, (self.__class__,), state
+
+    def detach(self):
+        """Drop the references to the DOM.
+        """
+        if self._tgvsPending:
+            self._parseTaggedValues()
+        for name in self.domAttributes:
+            node = getattr(self, name, None)
+            if getattr(node, 'xmiElement', None) is self:
+                del node.xmiElement
+            setattr(self, name, None)
+
+    def __setstate__(self, state):
+        children = state.pop('__children__')
+        Node.__init__(self, state.get('__name__'))
+        for name in self.domAttributes:
+            state.setdefault(name, None)
+        self.__dict__.update(state)
+        for key, child in children:
+            # the child may not be restored yet, bypass the node index
+            self._node_impl().__setitem__(self, key, child)
+
+    def bind(self, parent):
+        """Share registry and flavor of the parent this element is attached
+        to.
+        """
+        self.registry = parent.registry
+        if parent.__XMI__ is not None:
+            self.__XMI__ = parent.__XMI__
+
     @property 
     def XMI(self):
-        if self.__XMI__:
+        if self.__XMI__ is not None:
             return self.__XMI__
+        # not bound when attached, the parents had no flavor yet
         for parent in LocationIterator(self):
-            if parent.__XMI__:
-                return parent.__XMI__
+            if parent.__XMI__ is not None:
+                self.__XMI__ = parent.__XMI__
+                return self.__XMI__
         raise AttributeError, 'No XMI flavor given' 
 
-    #def getParent(self):
-    #    return self.__parent__
+    def getParent(self):
+        return self.__parent__
 
     def _parseTaggedValues(self):
         """Gather the tagnames and tagvalues for the element.
         """
-        log.debug("Gathering the taggedvalues for element %s.", self.__name__)
+        self.__dict__.pop('_tgvsPending', None)
+        debug = log.isEnabledFor(logging.DEBUG)
+        if debug:
+            log.debug("Gathering the taggedvalues for element %s.",
+                      self.__name__)
         tgvsm = getElementByTagName(self.domElement,
                                     self.XMI.TAGGED_VALUE_MODEL,
                                     default=None,
                                     recursive=0)
         if tgvsm is None:
-            log.debug("Found nothing.")
             return
         tgvs = getElementsByTagName(tgvsm,
                                     self.XMI.TAGGED_VALUE,
                                     recursive=0)
+        values = odict()
         for tgv in tgvs:
             try:
                 tagname, tagvalue = self.XMI.getTaggedValue(tgv)
-                log.debug("Found tag '%s' with value '%s'.", tagname, tagvalue)
-                if self.tgvs.has_key(tagname):
-                    log.debug("Invoking Poseidon multiline fix for "
-                              "tagname '%s'.", tagname)
-                    self.tgvs[tagname] += '\n'+tagvalue
-                else:
-                    self.tgvs[tagname] = tagvalue
             except TypeError, e:
                 log.warn("Broken tagged value in id '%s'.",
                          self.XMI.getId(self.domElement))
-        log.debug("Found the following tagged values: %r.",
-                  self.tgvs)
+                continue
+            parts = values.get(tagname)
+            if parts is None:
+                values[tagname] = [tagvalue]
+            elif isinstance(parts[0], basestring) \
+                 and isinstance(tagvalue, basestring):
+                # Poseidon splits multiline values into several tags
+                parts.append(tagvalue)
+            else:
+                log.warn("Broken tagged value in id '%s'.",
+                         self.XMI.getId(self.domElement))
+        for tagname, parts in values.items():
+            if len(parts) == 1:
+                self.tgvs[tagname] = parts[0]
+            else:
+                self.tgvs[tagname] = '\n'.join(parts)
+        if debug:
+            log.debug("Found the following tagged values: %r.", self.tgvs)
 
     def _initFromDOM(self):
         domElement = self.domElement
-        if not domElement:
+        if domElement is None:
             return 
 
         self.id = str(domElement.getAttribute('xmi.id'))
         self.__name__ = self.XMI.getName(domElement)
         log.debug("Initializing from DOM: name='%s', id='%s'.",
                   self.__name__, self.id)
-        self._parseTaggedValues()
+        # parsed when first read
+        self._tgvsPending = True
         self._calculateStereotype()
         mult = getElementByTagName(domElement,
                                    self.XMI.MULTIPLICITY,
                                    None)
-        if mult:
+        if mult is not None:
             maxNodes = mult.getElementsByTagName(self.XMI.MULT_MAX)
             if maxNodes and len(maxNodes):
                 maxNode = maxNodes[0]
@@ -164,16 +540,39 @@ class XMIElement(Node):
 
     @property
     def name(self):
-        if self.__name__:
-            normalize(self.__name__)
-        else:
-            normalize(self.id)
-        return normalize(res)
+        return normalize(self.__name__ or self.id)
+
+    @property
+    def xminame(self):
+        # BBB, elements kept their name as ``xminame`` before being nodes
+        return self.__name__
     
     @property
     def classcategory(self):
         return "%s.%s" % (self.__class__.__module__, self.__class__.__name__)
 
+    _qualifiedName = None
+
+    @property
+    def qualifiedName(self):
+        """Dotted names of the element and its owners below the model.
+
+        Computed once, the registry resets it when reindexing.
+        """
+        if self._qualifiedName is None:
+            names = []
+            o = self
+            while o is not None and not IXMIModel.providedBy(o):
+                names.append(o.__name__ or '')
+                # nodes without children are false, compare with None
+                parent = o.__parent__
+                if parent is None:
+                    parent = getattr(o, 'package', None)
+                o = parent
+            names.reverse()
+            self._qualifiedName = '.'.join(names)
+        return self._qualifiedName
+
     def hasAttributeWithTaggedValue(self, tag, value=None):
         """Return True if any attribute has a TGV 'tag'.
 
@@ -202,6 +601,9 @@ class XMIElement(Node):
         log.debug("No, found nothing.")
         return False
 
+    # (striphtml, wrap) -> (documentation, formatted)
+    _documentation = None
+
     def getDocumentation(self, striphtml=0, wrap=-1):
         """Return formatted documentation string.
 
@@ -211,33 +613,26 @@ class XMIElement(Node):
 
         striphtml(boolean) -- use stripogram html2text to remove html tags
 
-        wrap(integer) -- default: 60, set to 0: do not wrap,
+        wrap(integer) -- default: 64, set to 0: do not wrap,
                          all other >0: wrap with this value
+
+        The documentation is formatted on first access and cached per
+        arguments.
         """
         
         # XXX nice convinience, but should be moved outside xmiparser (jens)
         #     move this to ``agx.io.uml`` as datareader (rnix)
 
-        log.debug("Not Implemented: Trying to find documentation for element.")
-
-        # XXX TODO: fetch UML documentation? 
-        return '' # ??
-
-        # The rest isn't executed.
-#        doc = documentation_of_element #todo
-#        if not doc:
-#            log.debug("Didn't find a 'documentation'. "
-#                      "Returning empty string.")
-#            return ''
-#        if wrap == -1:
-#            wrap = 64
-#        doc = html2text(doc, (), 0, 1000000).strip()
-#        if wrap:
-#            log.debug("Wrapping the documenation.")
-#            doc = doWrap(doc, wrap)
-#        log.debug("Returning documenation '%r'.",
-#                  doc)
-#        return doc
+        doc = self.tgvs.get('documentation', '')
+        key = (bool(striphtml), wrap)
+        if self._documentation is None:
+            self._documentation = {}
+        cached = self._documentation.get(key)
+        if cached is not None and cached[0] == doc:
+            return cached[1]
+        res = formatDocumentation(doc, striphtml, wrap)
+        self._documentation[key] = (doc, res)
+        return res
 
     def getUnmappedCleanName(self):
         return self.unmappedCleanName
@@ -297,9 +692,12 @@ class XMIElement(Node):
         pass
     
     def addOperationDefs(self, m):
-        if m.xminame:
+        if m.__name__:
             self.operationDefs.append(m)
 
+    def addSubType(self, st):
+        self.subTypes.append(st)
+
     def getOperationDefs(self, recursive=0):
         log.debug("Getting method definitions (recursive=%s)...", recursive)
         res = [m for m in self.operationDefs]
@@ -313,7 +711,7 @@ class XMIElement(Node):
         return res
 
     def _calculateStereotype(self):
-        return self.XMI.calculateStereotype(self)
+        return self.XMI.calculateStereoType(self)
 
     def hasStereotype(self, stereotypes):
         """XXX: Convenience, move outside ??
@@ -401,6 +799,7 @@ class StateMachineContainer(object):
     """Mixin to be a statemachine container.
     """
     implements(IXMIStateMachineContainer)
+    statemachines = allocateOnWrite('statemachines', list)
        
     def __init__(self):
         self.statemachines = []
@@ -409,14 +808,14 @@ class StateMachineContainer(object):
         log.debug("Trying to find statemachines...")
         try:
             ownedElement = getElementByTagName(self.domElement,
-                                               [XMI.OWNED_ELEMENT,
+                                               [self.XMI.OWNED_ELEMENT,
                                                 self.XMI.OWNED_BEHAVIOR],
                                                default=None)
         except:
             log.debug("Getting the owned element the normal way didn't work.")
             try:
                 ownedElement = getElementByTagName(self.domElement,
-                                                   [XMI.OWNED_BEHAVIOR],
+                                                   [self.XMI.OWNED_BEHAVIOR],
                                                    default=None, recursive=1)
             except:
                 log.debug("Getting the owned element the poseidon 3.1 "
@@ -425,7 +824,7 @@ class StateMachineContainer(object):
                 log.debug("Backward compatability mode for argouml's xmi1.0.")
                 ownedElement = self.XMI.getOwnedElement(self.domElement)
 
-        if not ownedElement:
+        if ownedElement is None:
             log.debug("Setting ownedElement to self.domElement as fallback.")
             ownedElement = self.domElement
         log.debug("We set the owned element as: %s.", ownedElement)
@@ -438,9 +837,11 @@ class StateMachineContainer(object):
         res = {}
         statemachines = self.findStateMachines()
         for m in statemachines:
-            sm = XMIStateMachine(m, parent=self)
-            sm.initialize(name, m)
-            if sm.xminame:
+            if not self.XMI.getId(m):
+                continue
+            sm = XMIStateMachine(self.XMI.getName(m), m)
+            sm.initialize(self)
+            if sm.__name__:
                 # Determine the correct product where it belongs
                 products = [c.package.getProduct()
                             for c in sm.getClasses()]
@@ -448,19 +849,20 @@ class StateMachineContainer(object):
                 if products:
                     product = products[0]
                 else:
-                    products = self
+                    product = self
                 product.addStateMachine(sm)
-                res[sm.xminame] = sm
+                res[sm.__name__] = sm
         if recursive:
             for p in self.getPackages():
-                res.update(p.buildStateMachines())
+                res.update(p._buildStateMachines())
         return res
 
     def addStateMachine(self, sm, reparent=0):
-        if not sm in self.statemachines:
+        # elements compare like dicts, match by identity
+        if not [s for s in self.statemachines if s is sm]:
             self.statemachines.append(sm)
             if reparent:
-                sm.setParent(self)
+                sm.__parent__ = self
         if hasattr(self, 'isProduct') and not self.isProduct():
             self.getProduct().addStateMachine(sm, reparent=0)
         if not hasattr(self, 'isProduct'):
@@ -473,6 +875,9 @@ class XMIPackage(StateMachineContainer, XMIElement):
     implements(IXMIPackage)
     project = None
     isroot = 0
+    # build the contents when first accessed, not when initialized
+    lazy = False
+    _contentsPending = False
 
     def __init__(self, name, dom):
         self.classes = []
@@ -484,10 +889,56 @@ class XMIPackage(StateMachineContainer, XMIElement):
     def _initFromDOM(self):
         self.parentPackage = None
         XMIElement._initFromDOM(self)
+        if self.lazy:
+            self._contentsPending = True
+        else:
+            self._buildContents()
+
+    def _buildContents(self):
+        self.__dict__.pop('_contentsPending', None)
         self._buildPackages()
-        self._buildStateMachines()
         self._buildInterfaces()
         self._buildClasses()
+        # after the classes, state machines refer to them
+        self._buildStateMachines(recursive=0)
+        if self.lazy:
+            model = self._getModel()
+            model._linkGeneralizations(self.classes + self.interfaces)
+            model._linkRelations(self.classes + self.interfaces)
+
+    def _getModel(self):
+        for parent in LocationIterator(self):
+            if IXMIModel.providedBy(parent):
+                return parent
+
+    def _loadContents(self):
+        """Build the packages, interfaces and classes of a lazy package.
+        """
+        if self._contentsPending:
+            log.debug("Loading package '%s'.", self.__name__)
+            self._buildContents()
+
+    def __reduce__(self):
+        if self.lazy:
+            # the registry goes with the state, it must not change meanwhile
+            self._getModel().load()
+        return XMIElement.__reduce__(self)
+
+    def keys(self):
+        self._loadContents()
+        return XMIElement.keys(self)
+
+    def values(self):
+        self._loadContents()
+        return XMIElement.values(self)
+
+    def items(self):
+        self._loadContents()
+        return XMIElement.items(self)
+
+    def __iter__(self):
+        self._loadContents()
+        return XMIElement.__iter__(self)
 
 # XXX Later (rnix)
 
@@ -497,6 +948,7 @@ class XMIPackage(StateMachineContainer, XMIElement):
 
 
     def getClasses(self, recursive=0, ignoreInternals=True):
+        self._loadContents()
         res = [c for c in self.classes]
         if ignoreInternals:
             res = [c for c in self.classes if not c.isInternal()]            
@@ -522,6 +974,7 @@ class XMIPackage(StateMachineContainer, XMIElement):
         cl.package = self
 
     def getInterfaces(self, recursive=0):
+        self._loadContents()
         res = self.interfaces
         if recursive:
             res = list(res)
@@ -537,6 +990,7 @@ class XMIPackage(StateMachineContainer, XMIElement):
         self.packages.append(p)
 
     def getPackages(self, recursive=False):
+        self._loadContents()
         res=self.packages
 
         if recursive:
@@ -552,15 +1006,15 @@ class XMIPackage(StateMachineContainer, XMIElement):
             if self.XMI.getName(p) == 'java':
                 continue
             package = XMIPackage(self.XMI.getName(p), p)
+            package.lazy = self.lazy
             package.initialize(self)
             self.addPackage(package) # do this by self['foo'] = node
-            package.buildPackages()
 
     def _buildClasses(self):
         ownedElement = self.XMI.getOwnedElement(self.domElement)
-        if not ownedElement:
+        if ownedElement is None:
             log.warn("Empty package: '%s'.",
-                     self.xminame)
+                     self.__name__)
             return
 
         classes = getElementsByTagName(ownedElement, self.XMI.CLASS) + \
@@ -569,36 +1023,34 @@ class XMIPackage(StateMachineContainer, XMIElement):
             if c.nodeName == self.XMI.ASSOCIATION_CLASS:
                 # maybe it was already instantiated (when building relations)?
                 classId = c.getAttribute('xmi.id').strip()
-                if allObjects.has_key(classId):
-                    xc = allObjects[classId]
+                xc = self.registry.elements.get(classId)
+                if xc is not None:
                     xc.setPackage(self)
                 else:
-                    xc = XMIAssociationClass(c, package=self)
+                    xc = XMIAssociationClass(self.XMI.getName(c), c,
+                                             package=self)
+                    xc.initialize(self)
             else:
-                xc = XMIClass(c, package=self)
-            if xc.xminame:
+                xc = XMIClass(self.XMI.getName(c), c, package=self)
+                xc.initialize(self)
+            if xc.__name__:
                 self.addClass(xc)
 
-        for p in self.getPackages():
-            p.buildClasses()
-
     def _buildInterfaces(self):
         ownedElement = self.XMI.getOwnedElement(self.domElement)
-        if not ownedElement:
+        if ownedElement is None:
             log.warn("Empty package: '%s'.",
-                     self.xminame)
+                     self.__name__)
             return
 
         classes = getElementsByTagName(ownedElement, self.XMI.INTERFACE)
 
         for c in classes:
-            xc = XMIInterface(c, package=self)
-            if xc.xminame:
+            xc = XMIInterface(self.XMI.getName(c), c, package=self)
+            xc.initialize(self)
+            if xc.__name__:
                 self.addInterface(xc)
 
-        for p in self.getPackages():
-            p.buildInterfaces()
-
     def isRoot(self):
         # TBD Handle this through the stereotype registry
         return self.isroot or self.hasStereotype(['product', 'zopeproduct',
@@ -674,35 +1126,353 @@ class XMIPackage(StateMachineContainer, XMIElement):
         path or a relative path if the pack(self) is a subpack of 'ref'.
         """
         path = self.getPath(includeRoot=includeRoot, parent=ref)
-        return ".".join([p.xminame for p in path])
+        return ".".join([p.__name__ for p in path])
 
 class XMIModel(XMIPackage):
     implements(IXMIModel)
     isroot = 1
     parent = None
-    diagrams = {}
-    diagramsByModel = {}
-
-    def __init__(self, name, doc, XMI):
+    domAttributes = XMIPackage.domAttributes + ('document', 'model',
+                                                'content', 'domIds',
+                                                'generalizationRefs',
+                                                'relationRefs',
+                                                'linkedRelations')
+    domIds = None
+    generalizationRefs = None
+    relationRefs = None
+    linkedRelations = None
+
+    def __init__(self, name, doc, XMI, lazy=False):
+        """
+        @param lazy: build packages when they are first accessed
+        """
         self.__XMI__ = XMI
+        self.registry = XMIRegistry()
+        # Necessary for Poseidon because in Poseidon we cannot assign a name
+        # to a statemachine, so we have to pull the name of the statemachine
+        # from the diagram :(
+        self.diagrams = {}
+        self.diagramsByModel = {}
         self.document = doc
         self.model = self.XMI.getModel(doc)
         self.content = self.XMI.getContent(doc)
         XMIPackage.__init__(self, name, self.model)
-        
+        self.lazy = lazy
+        if lazy:
+            self._contentsPending = True
+            self._modelPending = True
+            self.model.xmiElement = self
+            self.registry.resolver = self.resolve
+
+    _modelPending = False
+
+    def load(self):
+        """Build all packages not built yet, then the diagrams and what
+        needs all classes.
+        """
+        packages = [self]
+        while packages:
+            # in document order, like the eager build
+            packages.extend(reversed(packages.pop().getPackages()))
+        if self._modelPending:
+            self._modelPending = False
+            self._buildModelElements()
+
+    def resolve(self, xmiid):
+        """Build the packages containing the element with xmiid and return
+        the element, or None.
+        """
+        if self.domIds is None:
+            self.domIds = {}
+            index = self.XMI.getIndex(self.document)
+            for nodes in index.elements.values():
+                for node in nodes:
+                    nodeid = node.getAttribute('xmi.id')
+                    if nodeid:
+                        self.domIds[str(nodeid)] = node
+        node = self.domIds.get(xmiid)
+        if node is None:
+            return None
+        while xmiid not in self.registry.elements:
+            # the innermost element built so far above node
+            parent = node.parentNode
+            while parent is not None and \
+                  getattr(parent, 'xmiElement', None) is None:
+                parent = parent.parentNode
+            if parent is None or \
+               not getattr(parent.xmiElement, '_contentsPending', False):
+                return None
+            parent.xmiElement._loadContents()
+        return self.registry.elements[xmiid]
+
+    def _linkGeneralizations(self, classes):
+        """Add the generalizations of classes just built, the classes at the
+        other end are built on demand.
+        """
+        if self.generalizationRefs is None:
+            self.generalizationRefs = {}
+            index = self.XMI.getIndex(self.document)
+            # the ends of all generalizations, without searching each one
+            ends = {}
+            gens = []
+            for tag in (self.XMI.GEN_PARENT, self.XMI.GEN_CHILD):
+                for end in index.getElementsByTagName(tag):
+                    gen = end.parentNode
+                    if id(gen) not in ends:
+                        if not self.XMI.getId(gen):
+                            continue
+                        ends[id(gen)] = []
+                        # referenced, the identity stays unique
+                        gens.append(gen)
+                    ref = getSubElement(end).getAttribute('xmi.idref')
+                    ends[id(gen)].append(str(ref))
+            for gen in gens:
+                ref = ends[id(gen)]
+                if len(ref) != 2:
+                    log.warn("Generalization without parent or child "
+                             "'%s'.", ref[0])
+                    continue
+                ref = tuple(ref)
+                for classid in set(ref):
+                    self.generalizationRefs.setdefault(classid, []).append(ref)
+        for klass in classes:
+            for ref in self.generalizationRefs.pop(klass.id, ()):
+                parid, childid = ref
+                other = parid == klass.id and childid or parid
+                refs = self.generalizationRefs.get(other)
+                if refs is not None and ref in refs:
+                    refs.remove(ref)
+                try:
+                    par = self.registry[parid]
+                    child = self.registry[childid]
+                except KeyError:
+                    log.warn("Object not found for generalization of "
+                             "'%s' from '%s'.", childid, parid)
+                    continue
+                par.addGenChild(child)
+                child.addGenParent(par)
+
+    def _linkRelations(self, classes):
+        """Build the associations, realizations and dependencies of classes
+        just built, the classes at the other end are built on demand.
+        """
+        XMI = self.XMI
+        if self.relationRefs is None:
+            self.relationRefs = {}
+            self.linkedRelations = {}
+            index = XMI.getIndex(self.document)
+            for kind, tags in (('rels', [XMI.ASSOCIATION,
+                                         XMI.ASSOCIATION_CLASS]),
+                               ('abs', [XMI.ABSTRACTION]),
+                               ('deps', [XMI.DEPENDENCY])):
+                for node in index.getElementsByTagName(tags):
+                    if not XMI.getId(node):
+                        continue
+                    for classid in set(self._getRelationEnds(kind, node)):
+                        self.relationRefs.setdefault(classid, []).append(
+                            (kind, node))
+        todo = {'rels': [], 'abs': [], 'deps': []}
+        for klass in classes:
+            for kind, node in self.relationRefs.pop(klass.id, ()):
+                # the other ends are built in between, skip them there
+                if id(node) in self.linkedRelations:
+                    continue
+                self.linkedRelations[id(node)] = True
+                todo[kind].append(node)
+        for nodes in todo.values():
+            for node in nodes:
+                self._buildOwner(node)
+        doc = self.document
+        XMI.buildRelations(doc, self.registry, rels=todo['rels'])
+        XMI.buildRealizations(doc, self.registry, abs=todo['abs'])
+        XMI.buildDependencies(doc, self.registry, deps=todo['deps'])
+
+    def _getRelationEnds(self, kind, node):
+        XMI = self.XMI
+        if kind == 'rels':
+            ids = [XMI.getAssocEndParticipantId(end)
+                   for end in node.getElementsByTagName(XMI.ASSOCEND)]
+        else:
+            ids = []
+            for tag in (XMI.DEP_CLIENT, XMI.DEP_SUPPLIER):
+                el = getElementByTagName(node, tag, default=None,
+                                         recursive=1)
+                if el is not None:
+                    ids.extend([XMI.getIdRef(sub)
+                                for sub in getSubElements(el)])
+        return [str(i) for i in ids if i]
+
+    def _buildOwner(self, node):
+        """Build the package node is defined in, it becomes the parent of
+        the relation.
+        """
+        parent = node.parentNode
+        while getattr(parent, 'getAttribute', None) is not None:
+            ownerid = parent.getAttribute('xmi.id')
+            if ownerid:
+                self.registry.get(str(ownerid))
+                return
+            parent = parent.parentNode
+
+    def detach(self):
+        self.load()
+        self.registry.resolver = None
+        elements = [self] + self.registry.values() + self.diagrams.values()
+        seen = set()
+        while elements:
+            element = elements.pop()
+            if id(element) in seen:
+                continue
+            seen.add(id(element))
+            XMIElement.detach(element)
+            elements.extend(element.values())
+        self.XMI.detach()
+
+    def getElementsByStereotype(self, stereotype, iface=None):
+        """Return the elements with stereotype, in build order.
+
+        @param iface: only return elements providing this interface
+        """
+        if self.lazy:
+            self.load()
+        res = self.registry.stereotypes.get(stereotype, [])
+        if iface is not None:
+            return [e for e in res if iface.providedBy(e)]
+        return list(res)
+
+    def getElementsByTaggedValue(self, tag, value=_marker, iface=None):
+        """Return the elements having the tagged value tag, in build order.
+
+        @param value: only return elements where tag has this value
+        @param iface: only return elements providing this interface
+        """
+        if self.lazy:
+            self.load()
+        self.registry.indexTaggedValues()
+        if value is _marker:
+            res = self.registry.tags.get(tag, [])
+        else:
+            res = self.registry.taggedValues.get((tag, value), [])
+        if iface is not None:
+            return [e for e in res if iface.providedBy(e)]
+        return list(res)
+
+    def prepareDocumentation(self, striphtml=0, wrap=-1, workers=None,
+                             processes=False):
+        """Format the documentation of all elements at once.
+
+        Equal texts are formatted once. ``getDocumentation`` with the same
+        arguments answers from the cache afterwards.
+
+        @param workers: number of threads, or processes if processes is
+                        true. With None or 1 everything is formatted in this
+                        thread.
+        """
+        elements = [self] + [e for e in self.registry.values()
+                             if e is not self]
+        key = (bool(striphtml), wrap)
+        docs = {}
+        for element in elements:
+            doc = element.tgvs.get('documentation', '')
+            if doc:
+                docs[doc] = None
+        texts = docs.keys()
+        tasks = [(doc, striphtml, wrap) for doc in texts]
+        if workers is None or workers <= 1 or len(tasks) <= 1:
+            formatted = map(_formatDocumentation, tasks)
+        else:
+            if processes:
+                pool = multiprocessing.Pool(workers)
+            else:
+                pool = ThreadPool(workers)
+            try:
+                formatted = pool.map(_formatDocumentation, tasks,
+                                     chunksize=max(1, len(tasks) // workers))
+            finally:
+                pool.close()
+                pool.join()
+        docs = dict(zip(texts, formatted))
+        for element in elements:
+            doc = element.tgvs.get('documentation', '')
+            if element._documentation is None:
+                element._documentation = {}
+            element._documentation[key] = (doc, docs.get(doc, ''))
+        log.debug("Formatted %d documentation strings of %d elements.",
+                  len(texts), len(elements))
+
+    generalizationCycles = ()
+
+    def linearizeGeneralizations(self):
+        """Compute the ancestors of all classes once.
+
+        Cycles found are kept in ``generalizationCycles``. Descendants are
+        collected when first asked for.
+        """
+        classes = [e for e in self.registry.values()
+                   if IXMIClass.providedBy(e)]
+        self.generalizationCycles = linearizeGeneralizations(classes)
+
+    def lookup(self, qualifiedName, default=_marker):
+        """Return the package, class, interface, attribute or operation
+        with qualifiedName, like 'pkg.sub.Class'.
+        """
+        if self.lazy and qualifiedName not in self.registry.names:
+            self._loadPath(qualifiedName)
+        try:
+            return self.registry.names[qualifiedName]
+        except KeyError:
+            if default is _marker:
+                raise
+            return default
+
+    def _loadPath(self, qualifiedName):
+        """Build the packages whose qualified name is a prefix of
+        qualifiedName, until it is found.
+        """
+        packages = [self]
+        while packages and qualifiedName not in self.registry.names:
+            package = packages.pop()
+            if package is not self and \
+               not qualifiedName.startswith(package.qualifiedName + '.'):
+                continue
+            packages.extend(package.getPackages())
+
+    def reindex(self, element=None):
+        """Update the query index after stereotypes, tagged values or names
+        of element, or of all elements, changed.
+        """
+        if element is not None:
+            self.registry.index(element)
+            return
+        for element in self.registry.values():
+            self.registry.index(element)
+
     def _initFromDOM(self):
+        XMIPackage._initFromDOM(self)
+        if self.lazy:
+            return
         doc = self.document
+        self._buildModelElements()
+        self.XMI.buildRelations(doc, self.registry)
+        self.XMI.buildGeneralizations(doc, self.registry)
+        self.linearizeGeneralizations()
+        self.XMI.buildRealizations(doc, self.registry)
+        self.XMI.buildDependencies(doc, self.registry)
+
+    def _buildModelElements(self):
+        """Build the diagrams, attach classes to the state machines named
+        by their ``use_workflow`` and mark internal classes.
+
+        Needs all packages, lazy models run it from ``load``.
+        """
         self._buildDiagrams()
         self._associateClassesToStateMachines()
         for c in self.getClasses(recursive=1):
-            if c.xminame in ['int', 'void', 'string'] and not \
+            if c.__name__ in ['int', 'void', 'string'] and not \
                c.hasStereotype(self.XMI.generate_datatypes) and c.isEmpty():
                 c.internalOnly = 1
-                log.debug("Internal class (not generated): '%s'.", c.xminame)
-        self.XMI.buildRelations(doc, allObjects)
-        self.XMI.buildGeneralizations(doc, allObjects)
-        self.XMI.buildRealizations(doc, allObjects)
-        self.XMI.buildDependencies(doc, allObjects)
+                log.debug("Internal class (not generated): '%s'.",
+                          c.__name__)
 
     def findStateMachines(self):
         statemachines = getElementsByTagName(self.content,
@@ -742,11 +1512,148 @@ class XMIModel(XMIPackage):
             if uf is None:
                 continue
             wf = smdict.get(uf)
-            if not wf:
+            if wf is None:
                 log.debug('associated workflow does not exist: %s' % uf)
                 continue
             smdict[uf].addClass(cl)
 
+def formatDocumentation(doc, striphtml=0, wrap=-1):
+    """Format a documentation string like ``XMIElement.getDocumentation``.
+    """
+    if not doc:
+        return ''
+    if wrap == -1:
+        wrap = 64
+    if striphtml:
+        doc = html2text(doc, (), 0, 1000000)
+    doc = doc.strip()
+    if wrap:
+        doc = doWrap(doc, wrap)
+    return doc
+
+def _formatDocumentation(args):
+    return formatDocumentation(*args)
+
+_VISITING = 1
+_DONE = 2
+
+def linearizeGeneralizations(classes):
+    """Compute the ancestors of classes and all their ancestors in C3 order.
+
+    Iterative, deep hierarchies don't hit the recursion limit. Generalization
+    cycles are logged and returned as lists of classes. The parent closing a
+    cycle stays an ancestor, only its own ancestors are not followed.
+    """
+    linearizations = {}
+    cycles = []
+    state = {}
+    for start in classes:
+        if id(start) in state:
+            continue
+        state[id(start)] = _VISITING
+        stack = [(start, iter(start.genParents))]
+        broken = {}
+        while stack:
+            klass, parents = stack[-1]
+            for parent in parents:
+                if state.get(id(parent)) is None:
+                    state[id(parent)] = _VISITING
+                    stack.append((parent, iter(parent.genParents)))
+                    break
+                if state[id(parent)] == _VISITING:
+                    cycle = [k for k, i in stack]
+                    cycle = cycle[[id(k) for k in cycle].index(id(parent)):]
+                    log.warn("Generalization cycle: %s.", ' -> '.join(
+                        [str(k.__name__) for k in cycle + [parent]]))
+                    cycles.append(cycle)
+                    broken[(id(klass), id(parent))] = True
+            else:
+                stack.pop()
+                state[id(klass)] = _DONE
+                parents = _unique(klass.genParents)
+                seqs = []
+                for parent in parents:
+                    if (id(klass), id(parent)) in broken:
+                        # still being linearized, cut the recursion here
+                        seqs.append([parent])
+                    else:
+                        seqs.append(linearizations[id(parent)])
+                if len(parents) == 1:
+                    # the parent's linearization, nothing to merge
+                    ancestors = seqs[0]
+                else:
+                    seqs.append(parents)
+                    try:
+                        ancestors = _c3merge(seqs)
+                    except TypeError:
+                        log.warn("No consistent generalization order for "
+                                 "'%s'.", klass.__name__)
+                        ancestors = _unique([a for seq in seqs for a in seq])
+                # a cycle leads back to klass
+                ancestors = [a for a in ancestors if a is not klass]
+                linearizations[id(klass)] = [klass] + ancestors
+                klass._cacheGeneralizations('_genAncestors', ancestors)
+    return cycles
+
+def _c3merge(seqs):
+    """Merge seqs in C3 order.
+
+    Each sequence is consumed through an index, the number of sequences
+    having an element in their tail is counted, so checking a head candidate
+    doesn't scan the other sequences.
+    """
+    seqs = [seq for seq in seqs if seq]
+    # elements compare like dicts, count by identity
+    tails = {}
+    for seq in seqs:
+        for element in seq[1:]:
+            tails[id(element)] = tails.get(id(element), 0) + 1
+    heads = [0] * len(seqs)
+    remaining = len(seqs)
+    res = []
+    while remaining:
+        for i in range(len(seqs)):
+            seq, pos = seqs[i], heads[i]
+            if pos < len(seq) and not tails.get(id(seq[pos])):
+                head = seq[pos]
+                break
+        else:
+            raise TypeError, 'inconsistent generalization hierarchy'
+        res.append(head)
+        for i in range(len(seqs)):
+            seq = seqs[i]
+            if heads[i] < len(seq) and seq[heads[i]] is head:
+                heads[i] += 1
+                if heads[i] < len(seq):
+                    # the next head leaves the tail
+                    tails[id(seq[heads[i]])] -= 1
+                else:
+                    remaining -= 1
+    return res
+
+def _unique(elements):
+    seen = {}
+    res = []
+    for element in elements:
+        if id(element) not in seen:
+            seen[id(element)] = True
+            res.append(element)
+    return res
+
+def _collectDescendants(klass):
+    """Breadth first, every descendant once, cycle safe.
+    """
+    res = []
+    seen = {id(klass): True}
+    queue = [klass]
+    for current in queue:
+        for child in current.genChildren:
+            if id(child) not in seen:
+                seen[id(child)] = True
+                res.append(child)
+                queue.append(child)
+    return res
+
 class XMIClass(XMIElement, StateMachineContainer):
     implements(IXMIClass)
     package = None
@@ -761,11 +1668,16 @@ class XMIClass(XMIElement, StateMachineContainer):
         # ugh, setPackage(). Handle this with some more generic zope3
         # parent() relation. [reinout]
         self.setPackage(kw.get('package', None))
-        log.debug("Package set to '%s'.", self.package.xminame)
+        log.debug("Package set to '%s'.",
+                  getattr(self.package, '__name__', None))
         log.debug("Running Parents's init...")
         XMIElement.__init__(self, name, dom, *args, **kw)
         self.assocsTo = []
         self.assocsFrom = []
+        # (fromEnd.aggregation, toEnd.aggregation) -> positions in assocsTo
+        # and assocsFrom
+        self.assocsToByAggregation = {}
+        self.assocsFromByAggregation = {}
         self.genChildren = []
         self.genParents = []
         self.realizationChildren = []
@@ -783,7 +1695,7 @@ class XMIClass(XMIElement, StateMachineContainer):
         self.XMI.calcClassAbstract(self)
         self.XMI.calcVisibility(self)
         self.XMI.calcOwnerScope(self)
-        self.buildStateMachines(recursive=0)
+        self._buildStateMachines(recursive=0)
         self.isComplex = True
 
     def isInternal(self):
@@ -806,9 +1718,16 @@ class XMIClass(XMIElement, StateMachineContainer):
 
     def addGenChild(self, c):
         self.genChildren.append(c)
+        self._generalizationsChanged()
 
     def addGenParent(self, c):
         self.genParents.append(c)
+        self._generalizationsChanged()
+
+    def _generalizationsChanged(self):
+        # invalidates the cached closures of all classes of the model
+        if self.registry is not None:
+            self.registry.generalizations += 1
 
     def getAttributeNames(self):
         return [a.xminame for a in self.getAttributeDefs()]
@@ -818,16 +1737,16 @@ class XMIClass(XMIElement, StateMachineContainer):
 
     def getGenChildren(self, recursive=0):
         """Return the generalization children.
+
+        Recursively, every descendant is returned once, nearest first.
         """
-        log.debug("Finding this class's children...")
-        res = [c for c in self.genChildren]
-        if recursive:
-            log.debug("Also looking recursively further down "
-                      "the family tree.")
-            for r in res:
-                res.extend(r.getGenChildren(1))
-        log.debug("Found: '%r'.", res)
-        return res
+        if not recursive:
+            return list(self.genChildren)
+        res = self._getGeneralizations('_genDescendants')
+        if res is None:
+            res = _collectDescendants(self)
+            self._cacheGeneralizations('_genDescendants', res)
+        return list(res)
 
     def getGenChildrenNames(self, recursive=0):
         """Returns the names of the generalization children.
@@ -836,26 +1755,44 @@ class XMIClass(XMIElement, StateMachineContainer):
 
     def getGenParents(self, recursive = 0):
         """Returns generalization parents.
+
+        Recursively, the ancestors are returned in C3 order, like the method
+        resolution order of python classes.
         """
-        log.debug("Looking for this class's parents...")
-        res = [c for c in self.genParents]
-        if recursive:
-            log.debug("Also looking recursively up the family tree.")
-            for r in res:
-                res.extend(r.getGenParents(1))
-        log.debug("Found the following parents: '%r'.", res)
-        return res
+        if not recursive:
+            return list(self.genParents)
+        res = self._getGeneralizations('_genAncestors')
+        if res is None:
+            linearizeGeneralizations([self])
+            res = self._getGeneralizations('_genAncestors')
+            if res is None:
+                # no registry to validate a cache
+                res = self._genAncestors[1]
+        return list(res)
+
+    # (generation of the registry, value) of the generalization closures
+    _genAncestors = None
+    _genDescendants = None
+
+    def _getGeneralizations(self, name):
+        cached = getattr(self, name)
+        generation = getattr(self.registry, 'generalizations', None)
+        if cached is None or generation is None or cached[0] != generation:
+            return None
+        return cached[1]
+
+    def _cacheGeneralizations(self, name, value):
+        setattr(self, name,
+                (getattr(self.registry, 'generalizations', None), value))
 
     def _buildChildren(self, domElement):
-        for el in domElement.getElementsByTagName(XMI.ATTRIBUTE):
-            att = XMIAttribute(el.name, el)
+        for el in domElement.getElementsByTagName(self.XMI.ATTRIBUTE):
+            att = XMIAttribute(self.XMI.getName(el), el)
             att.initialize(self)
-            att.setParent(self) # XXX remove
             self.addAttributeDef(att)
-        for el in domElement.getElementsByTagName(XMI.METHOD):
-            meth = XMIMethod(el.name, el)
+        for el in domElement.getElementsByTagName(self.XMI.METHOD):
+            meth = XMIMethod(self.XMI.getName(el), el)
             meth.initialize(self)
-            meth.setParent(self)
             self.addOperationDefs(meth)
 
 # XXX: this is stuff for the generator!
@@ -888,72 +1825,108 @@ class XMIClass(XMIElement, StateMachineContainer):
 
     def addAssocFrom(self, a):
         """Adds association originating FROM this class."""
-        self.assocsFrom.append(a)
+        self._addAssoc(a, self.assocsFrom, self.assocsFromByAggregation)
 
     def addAssocTo(self, a):
         """Adds association pointing AT this class."""
-        self.assocsTo.append(a)
+        self._addAssoc(a, self.assocsTo, self.assocsToByAggregation)
+
+    def _addAssoc(self, a, assocs, buckets):
+        key = (a.fromEnd.aggregation, a.toEnd.aggregation)
+        buckets.setdefault(key, []).append(len(assocs))
+        assocs.append(a)
+        if self.registry is not None:
+            self.registry.associations += 1
+
+    def _getAssocs(self, assocs, buckets, aggtypes, aggtypesTo):
+        positions = []
+        for fromAggregation in aggtypes:
+            for toAggregation in aggtypesTo:
+                positions.extend(
+                    buckets.get((fromAggregation, toAggregation), ()))
+        if len(positions) > 1:
+            # keep the order associations were added in
+            positions.sort()
+        return [assocs[i] for i in positions]
 
     def getFromAssociations(self, aggtypes=['none'], aggtypesTo=['none']):
         """Returns associations that point from this class."""
-        # This code doesn't seem to work with below isDependent method.
-        log.debug("Finding associations originating at this class...")
-        log.debug("Params: aggtypes='%r', aggtypesTo='%r'.",
-                  aggtypes, aggtypesTo)
-        result = [a for a in self.assocsFrom
-                  if a.fromEnd.aggregation in aggtypes
-                  and a.toEnd.aggregation in aggtypesTo]
-        log.debug("Associations found: %r.", result)
-        return result
+        return self._getAssocs(self.assocsFrom, self.assocsFromByAggregation,
+                               aggtypes, aggtypesTo)
 
     def getToAssociations(self, aggtypes=['none'], aggtypesTo=['none']):
         """Returns associations that point at this class."""
-        # This code doesn't seem to work with below isDependent method.
-        log.debug("Finding associations pointing at this class...")
-        log.debug("Params: aggtypes='%r', aggtypesTo='%r'.",
-                  aggtypes, aggtypesTo)
-        result = [a for a in self.assocsTo
-                  if a.fromEnd.aggregation in aggtypes
-                  and a.toEnd.aggregation in aggtypesTo]
-        log.debug("Associations found: %r.", result)
-        return result
+        return self._getAssocs(self.assocsTo, self.assocsToByAggregation,
+                               aggtypes, aggtypesTo)
+
+    # (generations of the registry, value) of isDependent
+    _dependent = None
 
     def isDependent(self):
         """Return True if class is only accessible through composition.
 
         Every object to which only composite associations point
-        shouldn't be created independently.
+        shouldn't be created independently. A class is dependent, too, if
+        one of its generalization parents is.
 
         To refresh the memory: an aggregation is an empty rhomb in
         UML, a composition is a filled rhomb. (Dutch: 'wybertje').
-        """
 
-        log.debug("Trying to figure out if the '%s' class is dependent.",
-                  self.xminame)
+        The verdict is cached per class until generalizations or
+        associations of the model change.
+        """
+        registry = self.registry
+        generation = None
+        if registry is not None:
+            generation = (registry.generalizations, registry.associations)
+        results = {}
+        def known(klass):
+            if id(klass) in results:
+                return True
+            cached = klass._dependent
+            if generation is not None and cached is not None \
+               and cached[0] == generation:
+                results[id(klass)] = cached[1]
+                return True
+            return False
+        # iterative, every class is decided once, parents first
+        visiting = {}
+        stack = [self]
+        while stack:
+            klass = stack[-1]
+            if known(klass):
+                stack.pop()
+                continue
+            if id(klass) not in visiting:
+                visiting[id(klass)] = True
+                # parents being decided further down the stack close a cycle
+                stack.extend([p for p in klass.genParents
+                              if id(p) not in visiting and not known(p)])
+                continue
+            stack.pop()
+            res = klass._isComposed()
+            for p in klass.genParents:
+                if results.get(id(p)):
+                    log.debug("Parent '%s' of '%s' is dependent.",
+                              p.__name__, klass.__name__)
+                    res = True
+            results[id(klass)] = res
+            if generation is not None:
+                klass._dependent = (generation, res)
+        log.debug("End verdict: '%s' dependent = '%s'.", self.__name__,
+                  results[id(self)])
+        return results[id(self)]
+
+    def _isComposed(self):
+        """Whether compositions but no aggregations contain this class.
+        """
         aggs = self.getToAssociations(aggtypes=['aggregate']) \
             or self.getFromAssociations(aggtypesTo=['aggregate'])
-        log.debug("Found aggregations that contain us: %r.", aggs)
+        if aggs:
+            return False
         comps = self.getToAssociations(aggtypes=['composite']) \
             or self.getFromAssociations(aggtypesTo=['composite'])
-        log.debug("Found compositions that contain us: %r.", comps)
-
-        if comps and not aggs:
-            log.debug("We *are* part of a composition plus we are "
-                      "not part of an aggregation, so we're stuck "
-                      "inside whatever it is that 'compositions' us.")
-            res = True
-        else:
-            log.debug("Our placing is not fixed, we're not dependent.")
-            res = False
-        log.debug("Check, though, if one of the parents is dependent."
-                  "If True, count the class as dependent.")
-        for p in self.getGenParents():
-            if p.isDependent():
-                log.debug("Yes, found a parent that is dependent. "
-                          "So we are too.")
-                res = True
-        log.debug("End verdict: dependent = '%s'.", res)
-        return res
+        return bool(comps)
 
     def isAbstract(self):
         return self.isabstract
@@ -1116,25 +2089,25 @@ class XMIMethodParameter(XMIElement):
 
     def _buildDefault(self):
         defparam = getElementByTagName(self.domElement, self.XMI.PARAM_DEFAULT, None)
-        if not defparam:
+        if defparam is None:
             return
         default = self.XMI.getExpressionBody(defparam)
         if default:
             self.default = default
             self.has_default = 1
 
-    def _initFromDOM(self, domElement):
-        XMIElement._initFromDOM()
-        self.buildDefault()
+    def _initFromDOM(self):
+        XMIElement._initFromDOM(self)
+        self._buildDefault()
 
     def getExpression(self):
         """Returns the param name and param=default expr if a
         default is defined.
         """
         if self.getDefault():
-            return "%s=%s" % (self.xminame, self.getDefault())
+            return "%s=%s" % (self.__name__, self.getDefault())
         else:
-            return self.xminame
+            return self.__name__
 
 class XMIMethod (XMIElement):
     implements(IXMIMethod)
@@ -1142,12 +2115,13 @@ class XMIMethod (XMIElement):
 
     def _buildParameters(self):
         self.params = []
-        parElements = self.domElement.getElementsByTagName(XMI.METHODPARAMETER)
+        parElements = self.domElement.getElementsByTagName(
+            self.XMI.METHODPARAMETER)
         for p in parElements:
             param = XMIMethodParameter(self.XMI.getName(p), p)
-            self.addParameter(XMIMethodParameter(p))
-            log.debug("Params of the method: %r.",
-                      self.params)
+            param.initialize(self)
+            self.addParameter(param)
+        log.debug("Params of the method: %r.", self.params)
 
     def _initFromDOM(self):
         XMIElement._initFromDOM(self)
@@ -1165,7 +2139,7 @@ class XMIMethod (XMIElement):
         return self.params
 
     def getParamNames(self):
-        return [p.xminame for p in self.params]
+        return [p.__name__ for p in self.params]
 
     def getParamExpressions(self):
         """Rturns the param names or paramname=default for each
@@ -1174,7 +2148,7 @@ class XMIMethod (XMIElement):
         return [p.getExpression() for p in self.params]
 
     def addParameter(self, p):
-        if p.xminame != 'return':
+        if p.__name__ != 'return':
             self.params.append(p)
 
     def testmethodName(self):
@@ -1206,7 +2180,7 @@ class XMIAttribute (XMIElement):
     def _findDefault(self):
         initval = getElementByTagName(self.domElement,
                                       self.XMI.ATTRIBUTE_INIT_VALUE, None)
-        if initval:
+        if initval is not None:
             default = self.XMI.getExpressionBody(initval)
             if default :
                 self.default = default
@@ -1217,7 +2191,7 @@ class XMIAttribute (XMIElement):
         self.XMI.calcVisibility(self)
         self.XMI.calcDatatype(self)
         self._findDefault()
-        self.mult = self.XMI.getMultiplicity(domElement, 1, 1)
+        self.mult = self.XMI.getMultiplicity(self.domElement, 1, 1)
 
     def getVisibility(self):
         return self.visibility
@@ -1238,6 +2212,9 @@ class XMIAttribute (XMIElement):
 
 class XMIAssocEnd (XMIElement):
     implements(IXMIAssocEnd)
+    obj = None
+    aggregation = None
+    isNavigable = False
 
     def associationEndName(self, ignore_cardinality=0):
         name = str(self.__name__)
@@ -1245,7 +2222,7 @@ class XMIAssocEnd (XMIElement):
             return name
         else:
             if self.getTarget():
-                res=self.getTarget().xminame.lower()
+                res=self.getTarget().__name__.lower()
                 if self.getUpperBound != 1 and not ignore_cardinality:
                     res+='s'
                 return res
@@ -1254,6 +2231,7 @@ class XMIAssocEnd (XMIElement):
 
     def _initFromDOM(self):
         super(XMIAssocEnd, self)._initFromDOM()
+        el = self.domElement
         navigable = 'isNavigable'
         val = el.getAttribute(navigable) 
         if not val:
@@ -1261,7 +2239,7 @@ class XMIAssocEnd (XMIElement):
         self.isNavigable = toBoolean(val)
         pid = self.XMI.getAssocEndParticipantId(el)
         if pid:
-            self.obj = allObjects[pid]
+            self.obj = self.registry[str(pid)]
             self.mult = self.XMI.getMultiplicity(el)
             self.aggregation = self.XMI.getAssocEndAggregation(el)
         else:
@@ -1348,15 +2326,15 @@ class XMIAssociation (XMIElement):
         return res
 
     def _initFromDOM(self):
-        super(XMIAssociation, self)._intFromDOM()
+        XMIElement._initFromDOM(self)
         self._buildEnds()
 
     def _buildEnds(self):
-        ends = self.domElement.getElementsByTagName(XMI.ASSOCEND)
-        self.fromEnd = XMIAssocEnd(ends[0])
-        self.toEnd = XMIAssocEnd(ends[1])
-        self.fromEnd.setParent(self)
-        self.toEnd.setParent(self)
+        ends = self.domElement.getElementsByTagName(self.XMI.ASSOCEND)
+        self.fromEnd = XMIAssocEnd(self.XMI.getName(ends[0]), ends[0])
+        self.fromEnd.initialize(self)
+        self.toEnd = XMIAssocEnd(self.XMI.getName(ends[1]), ends[1])
+        self.toEnd.initialize(self)
 
     def getParent(self):
         # XXX ?
@@ -1367,6 +2345,11 @@ class XMIAssociationClass(XMIClass, XMIAssociation):
     implements(IXMIAssociationClass)
     isAssociationClass = 1
 
+    def _initFromDOM(self):
+        # built with the classes of its package, the ends are built with the
+        # relations, once all classes are there
+        XMIClass._initFromDOM(self)
+
 class XMIAbstraction(XMIElement):
     implements(IXMIAbstraction)
 
@@ -1382,16 +2365,19 @@ class XMIDependency(XMIElement):
         return self.client
 
     def _initFromDOM(self):
-        super(XMIDependency, self)._initFromDOM(self)
-        self.buildEnds()
+        super(XMIDependency, self)._initFromDOM()
+        self._buildEnds()
 
     def _buildEnds(self):
         client_el = getElementByTagName(self.domElement, self.XMI.DEP_CLIENT)
         clid = self.XMI.getIdRef(getSubElement(client_el))
-        self.client = self.allObjects[clid]
         supplier_el = getElementByTagName(self.domElement, self.XMI.DEP_SUPPLIER)
         suppid = self.XMI.getIdRef(getSubElement(supplier_el))
-        self.supplier = self.allObjects[suppid]
+        self.client = self.registry.get(str(clid))
+        self.supplier = self.registry.get(str(suppid))
+        if self.client is None or self.supplier is None:
+            log.warn("Couldn't resolve dependency relation '%s'.", self.id)
+            return
         self.client.addClientDependency(self)
 
     def getParent(self):
@@ -1408,8 +2394,7 @@ class XMIStateMachine(XMIElement):
         self.transitions = []
         self.classes = []
         XMIElement.__init__(self, name, dom, *args, **kwargs)
-        self.setParent(kwargs.get('parent', None))
-        log.debug("Created statemachine '%s'.", self.id)
+        log.debug("Created statemachine '%s'.", name)
 
     def _initFromDOM(self):
         super(XMIStateMachine, self)._initFromDOM()
@@ -1419,7 +2404,6 @@ class XMIStateMachine(XMIElement):
 
     def addState(self, state):
         self.states.append(state)
-        state.setParent(self)
 
     def getStates(self, no_duplicates=None):
         ret = []
@@ -1447,18 +2431,21 @@ class XMIStateMachine(XMIElement):
     def _associateClasses(self):
         context = getElementByTagName(self.domElement,
                                       self.XMI.STATEMACHINE_CONTEXT, None)
-        if context:
+        if context is not None:
             clels = getSubElements(context)
             for clel in clels:
-                clid = self.XMI.getIdRef(clel)
-                cl = allObjects[clid]
+                clid = str(self.XMI.getIdRef(clel))
+                cl = self.registry.get(clid)
+                if cl is None:
+                    log.warn("Context '%s' of statemachine '%s' not found.",
+                             clid, self.id)
+                    continue
                 self.addClass(cl)
-        else:
+        elif IXMIClass.providedBy(self.getParent()):
             self.addClass(self.getParent())
 
     def addTransition(self, transition):
         self.transitions.append(transition)
-        transition.setParent(self)
 
     def getTransitions(self, no_duplicates=None):
         if not no_duplicates:
@@ -1489,14 +2476,16 @@ class XMIStateMachine(XMIElement):
                                     recursive=1)
         log.debug("Found %s simple states.", len(sels))
         for sel in sels:
-            state = XMIState(sel)
-            self.addState(state)
+            if self.XMI.getId(sel):
+                self.addState(self._buildState(sel))
 
         sels = getElementsByTagName(self.domElement, self.XMI.PSEUDOSTATE,
                                     recursive=1)
         log.debug("Found %s pseudo states (like initial states).", len(sels))
         for sel in sels:
-            state = XMIState(sel)
+            if not self.XMI.getId(sel):
+                continue
+            state = self._buildState(sel)
             if getAttributeValue(sel, self.XMI.PSEUDOSTATE_KIND, None) == 'initial' \
                or sel.getAttribute('kind') == 'initial':
                 log.debug("Initial state: '%s'.", state.getCleanName())
@@ -1506,14 +2495,23 @@ class XMIStateMachine(XMIElement):
         sels = getElementsByTagName(self.domElement, self.XMI.FINALSTATE,
                                     recursive=1)
         for sel in sels:
-            state = XMIState(sel)
-            self.addState(state)
+            if self.XMI.getId(sel):
+                self.addState(self._buildState(sel))
+
+    def _buildState(self, sel):
+        state = XMIState(self.XMI.getName(sel), sel)
+        state.initialize(self)
+        return state
 
     def _buildTransitions(self):
         tels = getElementsByTagName(self.domElement, self.XMI.TRANSITION,
                                     recursive=1)
         for tel in tels:
-            tran = XMIStateTransition(tel)
+            if not self.XMI.getId(tel):
+                # a reference from a state
+                continue
+            tran = XMIStateTransition(self.XMI.getName(tel), tel)
+            tran.initialize(self)
             self.addTransition(tran)
 
     def getClasses(self):
@@ -1576,19 +2574,20 @@ class XMIStateTransition(XMIElement):
 
     def _buildEffect(self):
         el = getElementByTagName(self.domElement, self.XMI.TRANSITION_EFFECT, None)
-        if not el:
+        if el is None:
             return
         actel = getSubElement(el)
-        self.action = XMIAction(actel)
-        self.action.setParent(self)
+        self.action = XMIAction(self.XMI.getName(actel), actel)
+        self.action.initialize(self)
 
     def _buildGuard(self):
         el = getElementByTagName(self.domElement, self.XMI.TRANSITION_GUARD,
                                  default=None)
-        if not el:
+        if el is None:
             return
         guardel = getSubElement(el)
-        self.guard = XMIGuard(guardel)
+        self.guard = XMIGuard(self.XMI.getName(guardel), guardel)
+        self.guard.initialize(self)
 
     def setSourceState(self, state):
         self.sourceState = state
@@ -1597,7 +2596,7 @@ class XMIStateTransition(XMIElement):
         return self.sourceState
 
     def getSourceStateName(self):
-        if self.getSourceState():
+        if self.getSourceState() is not None:
             return self.getSourceState().xminame
         else:
             return None
@@ -1609,7 +2608,7 @@ class XMIStateTransition(XMIElement):
         return self.targetState
 
     def getTargetStateName(self):
-        if self.getTargetState():
+        if self.getTargetState() is not None:
             return self.getTargetState().xminame
         else:
             return None
@@ -1618,7 +2617,7 @@ class XMIStateTransition(XMIElement):
         return self.action
 
     def getActionName(self):
-        if self.action:
+        if self.action is not None:
             return self.action.xminame
 
     def getBeforeActionName(self):
@@ -1699,7 +2698,7 @@ class XMIAction(XMIElement):
     def _initFromDOM(self):
         XMIElement._initFromDOM(self)
         self.expression = self.XMI.getExpressionBody(self.domElement,
-                                                tagname=XMI.ACTION_EXPRESSION)
+                                                tagname=self.XMI.ACTION_EXPRESSION)
 
     def getExpressionBody(self):
         return self.expression
@@ -1741,7 +2740,7 @@ class XMIGuard(XMIElement):
     def _initFromDOM(self):
         XMIElement._initFromDOM(self)
         self.expression = self.XMI.getExpressionBody(self.domElement,
-                                                tagname=XMI.BOOLEAN_EXPRESSION)
+                                                tagname=self.XMI.BOOLEAN_EXPRESSION)
 
     def getExpressionBody(self):
         return self.expression
@@ -1753,30 +2752,29 @@ class XMIState(XMIElement):
     def __init__(self, name, dom, *args, **kwargs):
         self.incomingTransitions = []
         self.outgoingTransitions = []
-        XMIElement.__init__(name, dom, *args, **kwargs)
+        XMIElement.__init__(self, name, dom, *args, **kwargs)
 
     def _initFromDOM(self):
         XMIElement._initFromDOM(self)
         self._associateTransitions()
 
     def _associateTransitions(self):
-        vertices = getElementByTagName(self.domElement,
-                                       self.XMI.STATEVERTEX_OUTGOING,
-                                       default=None)
-        if vertices:
-            for vertex in getSubElements(vertices):
-                trid = self.XMI.getIdRef(vertex)
-                tran = allObjects[trid]
-                self.addOutgoingTransition(tran)
-
-        vertices = getElementByTagName(self.domElement,
-                                       self.XMI.STATEVERTEX_INCOMING,
-                                       default=None)
-        if vertices:
+        for tag, add in ((self.XMI.STATEVERTEX_OUTGOING,
+                          self.addOutgoingTransition),
+                         (self.XMI.STATEVERTEX_INCOMING,
+                          self.addIncomingTransition)):
+            vertices = getElementByTagName(self.domElement, tag,
+                                           default=None)
+            if vertices is None:
+                continue
             for vertex in getSubElements(vertices):
-                trid = self.XMI.getIdRef(vertex)
-                tran = allObjects[trid]
-                self.addIncomingTransition(tran)
+                trid = str(self.XMI.getIdRef(vertex))
+                tran = self.registry.get(trid)
+                if tran is None:
+                    log.warn("Transition '%s' of state '%s' not found.",
+                             trid, self.id)
+                    continue
+                add(tran)
 
     def addIncomingTransition(self, tran):
         self.incomingTransitions.append(tran)
@@ -1819,12 +2817,6 @@ class XMIState(XMIElement):
 class XMICompositeState(XMIState):
     implements(IXMICompositeState)
 
-# Necessary for Poseidon because in Poseidon we cannot assign a name
-# to a statemachine, so we have to pull the name of the statemachine
-# from the diagram :(
-diagrams = {}
-diagramsByModel = {}
-
 class XMIDiagram(XMIElement):
     implements(IXMIDiagram)
     modelElement = None
@@ -1836,24 +2828,24 @@ class XMIDiagram(XMIElement):
     def _buildSemanticBridge(self):
         ownerel = getElementByTagName(self.domElement, self.XMI.DIAGRAM_OWNER,
                                       default=None)
-        if not ownerel:
-            print 'no ownerel'
+        if ownerel is None:
+            log.debug("Diagram without owner: '%s'.", self.id)
             return
 
         model_el = getElementByTagName(ownerel,
                                        self.XMI.DIAGRAM_SEMANTICMODEL_BRIDGE_ELEMENT,
                                        default=None, recursive=1)
-        if not model_el:
-            print 'no modelel'
+        if model_el is None:
+            log.debug("Diagram without model element: '%s'.", self.id)
             return
 
         el = getSubElement(model_el)
         idref = self.XMI.getIdRef(el)
-        self.modelElement = allObjects.get(idref, None)
+        self.modelElement = self.registry.get(idref, None)
 
         # Workaround for the Poseidon problem
-        if issubclass(self.modelElement.__class__, XMIStateMachine):
-            self.modelElement.__name__ = self.xminame
+        if isinstance(self.modelElement, XMIStateMachine):
+            self.modelElement.__name__ = self.__name__
 
     def getModelElementId(self):
         if self.modelElement:
@@ -40,19 +40,59 @@ def getElementsByTagName(domElement, tagName, recursive=0):
 
     The only difference from the original getElementsByTagName is
     the optional recursive parameter.
+
+    Nodes providing ``findElementsByTagNames`` (see ``lxmldom``) do the
+    lookup themselves.
     """
     if isinstance(tagName, basestring):
         tagNames = [tagName]
     else:
         tagNames = tagName
+    finder = getattr(domElement, 'findElementsByTagNames', None)
+    if finder is not None:
+        return finder(tuple(tagNames), recursive)
     if recursive:
         els = []
         for tag in tagNames:
             els.extend(domElement.getElementsByTagName(tag))
-    else:
-        els = [el for el in domElement.childNodes
-               if str(getattr(el, 'tagName', None)) in tagNames]
-    return els
+        return els
+    index = getChildIndex(domElement)
+    found = [index[tag] for tag in tagNames if tag in index]
+    if not found:
+        return []
+    if len(found) == 1:
+        return list(found[0])
+    # children of several tags, keep them in document order
+    tagSet = _tagSets.get(tagNames) if isinstance(tagNames, tuple) else None
+    if tagSet is None:
+        tagSet = frozenset(tagNames)
+        if isinstance(tagNames, tuple):
+            _tagSets[tagNames] = tagSet
+    return [el for el in domElement.childNodes
+            if getattr(el, 'tagName', None) in tagSet]
+
+# membership sets of the tag name tuples of the flavors
+_tagSets = {}
+
+def getChildIndex(domElement):
+    """Return the child elements of domElement by tag name.
+
+    Built on first use and kept on the node, documents are not changed once
+    parsed.
+    """
+    try:
+        return domElement.xmiChildIndex
+    except AttributeError:
+        pass
+    index = {}
+    for el in domElement.childNodes:
+        if el.nodeType == el.ELEMENT_NODE:
+            try:
+                index[el.tagName].append(el)
+            except KeyError:
+                index[el.tagName] = [el]
+    domElement.xmiChildIndex = index
+    return index
 
 def getElementByTagName(domElement, tagName, default=_marker, recursive=0):
     """Returns a single element by name and throws an error if more
@@ -69,6 +109,70 @@ def getElementByTagName(domElement, tagName, default=_marker, recursive=0):
         else:
             return default
 
+def iterElements(node):
+    """Yield all elements below node in document order.
+    """
+    stack = [iter(node.childNodes)]
+    while stack:
+        for child in stack[-1]:
+            if child.nodeType == child.ELEMENT_NODE:
+                yield child
+                stack.append(iter(child.childNodes))
+                break
+        else:
+            stack.pop()
+
+class TagIndex(object):
+    """Elements of a document by qualified tag name, in document order.
+
+    The index is built in a single traversal, document wide lookups read from
+    it instead of walking the DOM again.
+    """
+
+    def __init__(self, document):
+        self.document = document
+        self.elements = {}
+        walk = getattr(document, 'iterElements', None)
+        if walk is not None:
+            nodes = walk()
+        else:
+            nodes = iterElements(document)
+        elements = self.elements
+        for node in nodes:
+            tagName = node.tagName
+            try:
+                elements[tagName].append(node)
+            except KeyError:
+                elements[tagName] = [node]
+
+    def getElementsByTagName(self, tagName):
+        """Returns elements by tag name or a list of tag names.
+
+        Like recursive ``getElementsByTagName`` the result of several tag
+        names is grouped by tag name.
+        """
+        if isinstance(tagName, basestring):
+            return list(self.elements.get(tagName, []))
+        els = []
+        for tag in tagName:
+            els.extend(self.elements.get(tag, []))
+        return els
+
+    def getElementByTagName(self, tagName, default=_marker):
+        """Returns a single element by name and throws an error if more
+        than one exists.
+        """
+        els = self.getElementsByTagName(tagName)
+        if len(els) > 1:
+            raise TypeError, 'more than 1 element found'
+        try:
+            return els[0]
+        except IndexError:
+            if default == _marker:
+                raise
+            else:
+                return default
+
 def hasClassFeatures(domClass):
     return len(domClass.getElementsByTagName(XMI.FEATURE)) or \
                 len(domClass.getElementsByTagName(XMI.ATTRIBUTE)) or \